@@ -3,12 +3,11 @@ import numpy as np
 import imutils
 import os
 from skimage.morphology import binary_erosion, binary_dilation, binary_closing, skeletonize, thin, square, disk, closing, opening
-import queue
 
 def save_image(image, filename):
     cv2.imwrite(filename, image)
 
-def process_frame(frame, frame_count, index):
+def process_frame(frame, frame_count, index, output_dir="processed_images"):
     frame = frame[50:, :]
 
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -66,7 +65,6 @@ def process_frame(frame, frame_count, index):
 
     isolated_plate_gray = cv2.cvtColor(isolated_plate, cv2.COLOR_BGR2GRAY)
 
-    output_dir = "processed_images"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -76,7 +74,7 @@ def process_frame(frame, frame_count, index):
     save_image(dilated_image, os.path.join(output_dir, f"frame_{index}_{frame_count}_dilated.jpg"))
     print(f"Saved images for frame {frame_count}")
 
-def get_most_edged_area (frame, frame_count, index):
+def get_most_edged_area (frame, frame_count, index, output_dir="processed_images"):
     frame = frame[50:, :]
 
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -108,7 +106,6 @@ def get_most_edged_area (frame, frame_count, index):
     x, y, bw, bh = best_region
     texture = frame[y:y+bh, x:x+bw]
 
-    output_dir = "processed_images"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -117,23 +114,3 @@ def get_most_edged_area (frame, frame_count, index):
     save_image(texture, os.path.join(output_dir, f"frame_{index}_{frame_count}_highest_edge_texture.jpg"))
 
     print(f"Saved images for frame {frame_count}")
-
-def image_consumer(image_queue, index):
-    frame_count = 0
-
-    while True:
-        try:
-            frame = image_queue.get(timeout=10)  # Adjust timeout as needed
-            if frame is None:
-                print("No frame to process, exiting.")
-                break
-
-            frame_count += 1
-            print(f"Processing frame {frame_count}...")
-            process_frame(frame, frame_count,index)
-            print(f"Frame {frame_count} processed and saved.")
-        except queue.Empty:
-            print("Queue is empty, waiting for more frames.")
-            break
-        except Exception as e:
-            print(f"Error processing frame: {e}")
@@ -1,25 +1,285 @@
 from multiprocessing import Process, Queue
-from sampler import sample_video
-from extractor import image_consumer
+from multiprocessing.shared_memory import SharedMemory
+from sampler import iter_samples
+from extractor import process_frame, get_most_edged_area
+import argparse
+import hashlib
+import queue
+import json
+import time
 import cv2
-import skimage
+import numpy as np
 import os
-def main():
-    image_queue = Queue()
 
-    producer_process = Process(target=sample_video, args=(image_queue, "dataset/06.mp4"))
-    producer_process.start()
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+# Seconds between two checks that the workers are alive, while waiting
+RESULT_TIMEOUT = 5
+EXTRACTORS = {
+    "contours": process_frame,
+    "edges": get_most_edged_area,
+}
 
-    consumer_processes = []
-    for i in range(10):  
-        consumer_process = Process(target=image_consumer, args=(image_queue, i+1))
-        consumer_processes.append(consumer_process)
-        consumer_process.start()
 
-    producer_process.join()
+def find_videos(inputs):
+    """Video files among `inputs`, directories searched recursively."""
+    videos = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                videos.extend(os.path.join(root, name) for name in sorted(files)
+                              if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            print(f"Skipping {path}: not found.")
+    return sorted(set(os.path.abspath(video) for video in videos))
+
+
+def frame_bytes(video):
+    """Size of one decoded BGR frame of a video, 0 if it cannot be opened."""
+    cap = cv2.VideoCapture(video)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    return width * height * 3
+
+
+def output_name(video):
+    """
+    Name of the outputs of a video: its file name and a hash of its path.
+    The same in every run, so a resumed run or one over another folder
+    never overwrites the crops of a different video with the same name.
+    """
+    stem = os.path.splitext(os.path.basename(video))[0]
+    digest = hashlib.sha1(os.path.abspath(video).encode()).hexdigest()[:10]
+    return f"{stem}_{digest}"
+
+
+class Manifest:
+    """
+    Videos already extracted, keyed by path. A video counts as done only
+    once all its sampled frames were processed, and is extracted again if
+    the file changed since.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.videos = {}
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                self.videos = json.load(manifest_file).get("videos", {})
+
+    @staticmethod
+    def _signature(video):
+        stat = os.stat(video)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def is_done(self, video):
+        entry = self.videos.get(video)
+        return (entry is not None and entry.get("done")
+                and all(entry.get(key) == value
+                        for key, value in self._signature(video).items()))
+
+    def mark_done(self, video, frames, failed, seconds):
+        self.videos[video] = {**self._signature(video), "done": True,
+                              "frames": frames, "failed": failed,
+                              "seconds": round(seconds, 2)}
+        self.save()
+
+    def save(self):
+        # Written aside and renamed, so an interrupted run never leaves a
+        # truncated manifest
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as manifest_file:
+            json.dump({"videos": self.videos}, manifest_file, indent=2)
+        os.replace(temporary, self.path)
+
+
+def extract(slots, task, output_dir, mode):
+    slot, shape, name, frame_count = task
+    # A view on the slot, released when this function returns
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+    EXTRACTORS[mode](frame, frame_count, name, output_dir)
+
+
+def frame_worker(slot_names, tasks, results, output_dir, mode):
+    """
+    Process frames until the None sentinel. Frames are read from the
+    shared memory slot named in each task; the slot is handed back with
+    the result.
+    """
+    slots = [SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            ok = True
+            try:
+                extract(slots, task, output_dir, mode)
+            except Exception as e:
+                print(f"Error processing frame {task[3]} of {task[2]}: {e}")
+                ok = False
+            results.put((task[0], task[2], ok))
+    finally:
+        for slot in slots:
+            slot.close()
+
+
+class VideoProgress:
+    def __init__(self):
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.sampled = False
+        self.start = time.perf_counter()
+
+
+def run(videos, output_dir, workers, rate, manifest, mode, slots_per_worker=2):
+    """
+    Extract every video with `workers` processes; the main process decodes.
+        Returns:
+            int: frames processed
+    """
+    sizes = {video: frame_bytes(video) for video in videos}
+    for video in videos:
+        if not sizes[video]:
+            print(f"Skipping {video}: cannot be opened.")
+    videos = [video for video in videos if sizes[video]]
+    if not videos:
+        return 0
+    size = max(sizes.values())
+    slots = [SharedMemory(create=True, size=size)
+             for _ in range(workers * slots_per_worker)]
+    tasks, results = Queue(), Queue()
+    processes = [Process(target=frame_worker,
+                         args=([slot.name for slot in slots], tasks, results,
+                               output_dir, mode))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    free = list(range(len(slots)))
+    progress = {}
+    names = {}
+    total = 0
+
+    def finish(video, state):
+        seconds = time.perf_counter() - state.start
+        manifest.mark_done(video, state.processed, state.failed, seconds)
+        print(f"{video}: {state.processed} frames in {seconds:.1f}s "
+              f"({state.processed / max(seconds, 1e-9):.1f} frames/s)")
+
+    def collect(block):
+        """Handle one result (waiting for it) or every result ready."""
+        nonlocal total
+        while True:
+            try:
+                slot, name, ok = results.get(block=block,
+                                             timeout=RESULT_TIMEOUT)
+            except queue.Empty:
+                if not block:
+                    return
+                # A worker killed mid-frame never hands its slot back
+                dead = [process for process in processes
+                        if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"{len(dead)} worker(s) died (exit codes "
+                        f"{', '.join(str(p.exitcode) for p in dead)}); "
+                        f"run again to resume the unfinished videos")
+                continue
+            free.append(slot)
+            video = names[name]
+            state = progress[video]
+            state.processed += 1
+            state.failed += not ok
+            total += 1
+            if state.sampled and state.processed == state.submitted:
+                finish(video, state)
+            if block:
+                return
+
+    try:
+        for video in videos:
+            name = output_name(video)
+            names[name] = video
+            state = progress[video] = VideoProgress()
+            for frame_count, frame in iter_samples(video, rate):
+                if frame.nbytes > size:
+                    print(f"Skipping frame {frame_count} of {video}: "
+                          f"larger than the reported frame size.")
+                    continue
+                while not free:
+                    collect(block=True)
+                slot = free.pop()
+                np.ndarray(frame.shape, dtype=np.uint8,
+                           buffer=slots[slot].buf)[:] = frame
+                tasks.put((slot, frame.shape, name, frame_count))
+                state.submitted += 1
+                collect(block=False)
+            state.sampled = True
+            if state.processed == state.submitted:
+                finish(video, state)
+
+        while len(free) < len(slots):
+            collect(block=True)
+    finally:
+        # One sentinel per worker: each stops after its last frame
+        for _ in processes:
+            tasks.put(None)
+        for process in processes:
+            process.join()
+        for slot in slots:
+            slot.close()
+            slot.unlink()
+    return total
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract plate candidates from videos in parallel.")
+    parser.add_argument("inputs", nargs="+",
+                        help="video files or directories of videos")
+    parser.add_argument("--output", default="processed_images",
+                        help="folder the extracted images are written to")
+    parser.add_argument("--rate", type=float, default=0.1,
+                        help="seconds between two sampled frames")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes extracting frames")
+    parser.add_argument("--mode", choices=EXTRACTORS, default="contours",
+                        help="contours (process_frame) or edges "
+                             "(get_most_edged_area)")
+    parser.add_argument("--manifest", default=None,
+                        help="progress file, <output>/manifest.json by default")
+    parser.add_argument("--restart", action="store_true",
+                        help="extract videos already in the manifest again")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    manifest = Manifest(args.manifest
+                        or os.path.join(args.output, "manifest.json"))
+
+    videos = find_videos(args.inputs)
+    pending = [video for video in videos
+               if args.restart or not manifest.is_done(video)]
+    print(f"{len(videos)} videos, {len(videos) - len(pending)} already done.")
+    if not pending:
+        return
+
+    start = time.perf_counter()
+    frames = run(pending, args.output, max(1, args.workers), args.rate,
+                 manifest, args.mode)
+    seconds = time.perf_counter() - start
+    print(f"Processed {frames} frames of {len(pending)} videos in "
+          f"{seconds:.1f}s ({frames / max(seconds, 1e-9):.1f} frames/s, "
+          f"{max(1, args.workers)} workers)")
 
-    for consumer_process in consumer_processes:
-        consumer_process.join()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
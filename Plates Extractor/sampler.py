@@ -2,37 +2,55 @@ import cv2
 import os
 import argparse
 
-def sample_video(image_queue, video_source=0, rate=0.1):
-    cap = cv2.VideoCapture(video_source)
-    frame_rate = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = 0
+# Used when the container does not report its frame rate
+DEFAULT_FPS = 30
+
 
+def iter_samples(video_source=0, rate=0.1):
+    """
+    Yield (frame_count, frame) for one frame every `rate` seconds.
+    """
+    cap = cv2.VideoCapture(video_source)
     if not cap.isOpened():
-        print("Error opening video file.")
+        print(f"Error opening video file {video_source}.")
         return
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture frame.")
-            break
-        
-        if frame_count % int(frame_rate * rate) == 0:
-            image_queue.put(frame)
-            print(f"Saved: {frame_count}")
-        
-        frame_count += 1
-    
-    cap.release()
+    frame_rate = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    # Sample every frame when the rate is shorter than a frame
+    step = max(1, int(frame_rate * rate))
+    frame_count = 0
+
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_count % step == 0:
+                yield frame_count, frame
+            frame_count += 1
+    finally:
+        cap.release()
+
+
+def sample_video(image_queue, video_source=0, rate=0.1):
+    for frame_count, frame in iter_samples(video_source, rate):
+        image_queue.put(frame)
+        print(f"Saved: {frame_count}")
     print("Sampling complete.")
 
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sample frames from a video.")
-    
+
     parser.add_argument("video", type=str, help="Path to the video file.")
     parser.add_argument("--value", type=float, default=1.0,
                         help="Value for the sampling mode: seconds")
-    
+    parser.add_argument("--output", type=str, default="samples",
+                        help="Folder the sampled frames are written to.")
+
     args = parser.parse_args()
-    
-    sample_video(args.video, args.value)
\ No newline at end of file
+
+    os.makedirs(args.output, exist_ok=True)
+    for frame_count, frame in iter_samples(args.video, args.value):
+        cv2.imwrite(os.path.join(args.output, f"frame_{frame_count}.jpg"), frame)
+        print(f"Saved: {frame_count}")
+    print("Sampling complete.")
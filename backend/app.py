@@ -1,17 +1,25 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 import json
-import concurrent.futures
 import asyncio
 import logging
+from log_config import configure_logging
 import os
-import numpy as np
 import cv2
-from io import BytesIO
-from PIL import Image
-from wrapper import process_frame
-from collections import Counter
-
-logging.basicConfig(level=logging.INFO)  # Set the desired log level
+from wrapper import DETECTORS
+from model_registry import warm_up, get_registry
+from frame_pipeline import (
+    FramePipeline, get_executor, shutdown_executor, DEFAULT_WORKERS)
+from frame_sender import FrameSender
+from frame_source import VideoFrameReader, GrowingFileCapture, LiveFrameSource
+from upload_store import (
+    open_upload, finish_upload, parse_binary_message,
+    KIND_UPLOAD_CHUNK, KIND_FRAME)
+from sessions import SessionRegistry, FairScheduler, JobAdmission, JobRejected
+from metrics import registry as metrics_registry
+
+# Levels per module from CARLENS_LOG_LEVEL / CARLENS_LOG_LEVELS
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -20,176 +28,341 @@ app = FastAPI()
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Temporary storage for incoming video chunks
-video_chunks = {}
-
-
-def process_video_data(data):
+# One session per client, every session shares the worker pool: frames
+# get pool slots in turns and whole videos go through admission control
+sessions = SessionRegistry(UPLOAD_FOLDER)
+scheduler = FairScheduler(2 * DEFAULT_WORKERS)
+admission = JobAdmission()
+metrics_registry.register_gauges("sessions", sessions.stats)
+metrics_registry.register_gauges("jobs", admission.stats)
+metrics_registry.register_gauges("frame_slots", scheduler.stats)
+
+@app.on_event("startup")
+async def load_character_model():
+    """Load the character model once before serving any frame."""
     try:
-        # Convert binary data to NumPy array
-        np_arr = np.frombuffer(data, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)  # Decode image to frame
-
-        if frame is None:
-            raise ValueError("Failed to decode the image.")
-
-        # Process the frame
-        processed_frame = process_frame(frame, 0)
-
-        if processed_frame is not None:
-            # Display the processed frame
-            cv2.imshow('Processed Frame', processed_frame)
-    except Exception as e:
-        logger.error(f"Error processing video data: {e}")
-
-
-def create_mp4_from_bytes(filename, data):
-    with open(filename, "wb") as mp4_file:
-        for offset, chunk in data:
-            chunk_bytes = bytes(chunk)
-            logger.info(
-                f"Processing chunk at offset {offset}, size {len(chunk_bytes)} bytes")
-            mp4_file.seek(offset)
-            mp4_file.write(chunk_bytes)
-        logger.info(f"MP4 file {filename} created successfully")
+        stats = warm_up()
+        logger.info("Character model ready: %s", stats)
+    except OSError as e:
+        logger.error("Could not load character model: %s", e)
+    # Each worker's initializer warms the model up. Workers forked (Linux)
+    # after the load above inherit the loaded model, so that is a no-op;
+    # with spawn (macOS, Windows) every worker loads its own copy.
+    get_executor()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    shutdown_executor()
+
+
+@app.get("/model")
+async def model_stats():
+    """Report load time and memory use of the character model."""
+    return get_registry().stats()
+
+
+@app.get("/status")
+async def server_status():
+    """Report sessions, job admission and worker pool queueing."""
+    return {
+        "sessions": sessions.stats(),
+        "jobs": admission.stats(),
+        "frames": scheduler.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latency histograms, counters and queue gauges for Prometheus."""
+    return metrics_registry.render()
+
+
+async def receive_message(websocket):
+    """
+    Receive the next websocket message.
+        Returns:
+            tuple: (json_data, None) for text messages or
+                   (None, raw_bytes) for binary messages
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return None, message["bytes"]
+    return json.loads(message["text"]), None
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    logger.info("WebSocket connection established")
+    # A client reconnecting with its session id gets its uploads back
+    session = sessions.attach(websocket.query_params.get("session_id"))
+    logger.info("WebSocket connection established for session %s",
+                session.session_id)
+    # Every message to this client goes through its sender
+    sender = FrameSender(websocket)
+    upload = None
+    trace_upload = False
+    detector_upload = None
+    live_source = None
     try:
+        await sender.send_json({'type': 'SESSION', 'session_id': session.session_id})
         while True:
-            # Receive chunked data from the frontend
-            # Receive JSON with chunk, filename, and offset
-            data = await websocket.receive_json()
+            # Binary messages carry upload chunks and live frames, text
+            # messages carry JSON control messages
+            data, raw = await receive_message(websocket)
+
+            if raw is not None:
+                try:
+                    kind, offset, payload = parse_binary_message(raw)
+                except ValueError as e:
+                    logger.error("Invalid binary message: %s", e)
+                    continue
+                if kind == KIND_FRAME and live_source is not None:
+                    live_source.push(offset, payload)
+                    continue
+                if kind != KIND_UPLOAD_CHUNK or upload is None:
+                    logger.error(
+                        "Binary message received without an active upload or stream.")
+                    continue
+                try:
+                    upload.write(offset, payload)
+                except ValueError as e:
+                    # Not acknowledged: the client sends it again when the
+                    # upload is reported incomplete
+                    logger.error("Invalid upload chunk: %s", e)
+                    continue
+                # Acknowledge the chunk receipt
+                await sender.send_json({'type': 'RECEIVED_CHUNK', 'offset': offset})
+                continue
 
             message_type = data.get("type")
 
-            if message_type == "UPLOAD_CHUNK":
-                # Ensure that 'chunk' exists in the received data
-                if 'chunk' not in data or 'filename' not in data or 'offset' not in data:
+            if message_type == "UPLOAD_START":
+                if 'filename' not in data or 'size' not in data:
                     logger.error(
-                        "Invalid data received: Missing 'chunk', 'filename' or 'offset'.")
-                    continue  # Skip processing this message
-
-                chunk = data['chunk']
-                filename = data['filename']
-                offset = data['offset']
-
-                # Initialize the video data structure for the file if not already
-                if filename not in video_chunks:
-                    video_chunks[filename] = {
-                        'chunks': [],
-                        'size': 0
-                    }
-
-                # Append the chunk data
-                video_chunks[filename]['chunks'].append((offset, chunk))
-                video_chunks[filename]['size'] += len(chunk)
-
+                        "Invalid data received: Missing 'filename' or 'size'.")
+                    continue
+                # "upload_id" from an earlier UPLOAD_READY resumes that upload
+                upload = open_upload(session.uploads, session.upload_folder,
+                                     data['filename'], int(data['size']),
+                                     session.partial_folder,
+                                     data.get('upload_id'))
                 logger.info(
-                    f"Received chunk for {filename}, offset {offset}, total size {video_chunks[filename]['size']} bytes")
-
-                # Acknowledge the chunk receipt
-                await websocket.send_json({'type': 'RECEIVED_CHUNK', 'offset': offset})
+                    "Upload of %s ready, %d of %d bytes already received",
+                    upload.filename, upload.ranges.covered(), upload.size)
+                # The client skips the ranges already received (resume)
+                await sender.send_json({'type': 'UPLOAD_READY', **upload.status()})
+                # "trace": true saves a Chrome trace of the job
+                trace_upload = bool(data.get('trace'))
+                detector_upload = requested_detector(data)
+                if (data.get('progressive')
+                        and not session.has_upload_job(upload.upload_id)):
+                    # Decode as soon as a prefix of the file is on disk
+                    session.start_job(run_job(
+                        sender, upload.filename,
+                        lambda upload=upload, trace=trace_upload,
+                        detector=detector_upload:
+                        process_video_data_from_file(
+                            sender, session.session_id, upload=upload,
+                            trace=trace, detector=detector)),
+                        upload_id=upload.upload_id)
 
             # Check if the upload is complete (we can send a signal from the frontend when all chunks are uploaded)
             elif message_type == 'UPLOAD_COMPLETED':
-                logger.info(
-                    f"Upload complete for {filename}, total size {video_chunks[filename]['size']} bytes")
-                # Sort chunks by offset and write the file
-                video_chunks[filename]['chunks'].sort(
-                    key=lambda x: x[0])  # Sort by offset
-                video_file_path = os.path.join(UPLOAD_FOLDER, filename)
-
-                # Open the file in write-binary mode
-                create_mp4_from_bytes(
-                    video_file_path, video_chunks[filename]['chunks'])
-
-                # Clear stored data
-                del video_chunks[filename]
+                if upload is None:
+                    logger.error("UPLOAD_COMPLETED received without an upload.")
+                    continue
+                if not upload.is_complete():
+                    await sender.send_json({
+                        'type': 'UPLOAD_INCOMPLETE',
+                        'filename': upload.filename,
+                        'missing': upload.missing(),
+                    })
+                    continue
+                video_file_path = finish_upload(session.uploads, upload)
+                filename, upload_id = upload.filename, upload.upload_id
+                upload = None
 
                 # Notify frontend of completion using "UPLOAD_COMPLETED" event
-                await websocket.send_json({'type': 'UPLOAD_COMPLETED', 'filename': filename})
-                # Optionally, process the video after upload
-                # You can use OpenCV or other libraries here to process the video file
-                await process_video_data_from_file(websocket, video_file_path)
+                await sender.send_json({'type': 'UPLOAD_COMPLETED', 'filename': filename})
+                # A progressive job of this upload reads the file to its
+                # end; every other finished upload gets its own job, which
+                # run_job queues or rejects with JOB_REJECTED
+                if not session.has_upload_job(upload_id):
+                    session.start_job(run_job(
+                        sender, filename,
+                        lambda path=video_file_path, trace=trace_upload,
+                        detector=detector_upload:
+                        process_video_data_from_file(
+                            sender, session.session_id, path, trace=trace,
+                            detector=detector)),
+                        upload_id=upload_id)
+
+            elif message_type == 'STREAM_START':
+                # The client sends encoded frames as KIND_FRAME messages
+                if live_source is not None:
+                    live_source.end()
+                live_source = LiveFrameSource()
+                task = session.start_job(run_job(
+                    sender, "live stream",
+                    lambda source=live_source, trace=bool(data.get('trace')),
+                    detector=requested_detector(data):
+                    process_frames(sender, session.session_id, source,
+                                   "live stream", trace=trace,
+                                   detector=detector)))
+                # Rejected or ended, nothing reads the source any more:
+                # the frames still sent are dropped
+                task.add_done_callback(
+                    lambda _, source=live_source: source.close())
+
+            elif message_type == 'SENDER_CONFIG':
+                # Viewer-side quality/size of the returned frames
+                sender.configure(data.get('quality'), data.get('scale'))
+
+            elif message_type == 'STREAM_END':
+                if live_source is not None:
+                    live_source.end()
+                    live_source = None
 
     except WebSocketDisconnect:
         logger.info("WebSocket connection closed")
     except Exception as e:
-        logger.error(f"Error in WebSocket: {e}")
-
-
-async def process_frame_in_thread(websocket, thread_frames, frame_count, predictions_list):
-    """Process a frame in a separate thread."""
-    # Your frame processing logic goes here
-    # Process the frame (if needed)
-    frame = thread_frames[0]
-    processed_frame, predictions = process_frame(frame, frame_count)
-    predictions_list.extend(predictions)
-    # Send all frames to the frontend
-    await send_frame(websocket, processed_frame, frame_count)
-    for index, frame in enumerate(thread_frames[1:], start=1):
-        frame = frame[50:, :]
-        # for (x, y, w, h) in location:
-        #     cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        await send_frame(websocket, frame, frame_count + index)
-
-
-def vote_for_correct_string(strings):
-    # Constraints for each position
-    valid_first = set("123456789")
-    valid_middle = set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnoprstuvwxyz")
-    valid_last = set("123456789")
-
-    # Initialize a list to store the most common character for each position
-    voted_string = []
-
-    # Iterate over each character position (6 positions in total)
-    for i in range(6):
-        # Create a list of valid characters for this position
-        valid_chars = []
-
-        for string in strings:
-            if i == 0:  # First position: 1-9
-                if string[i] in valid_first:
-                    valid_chars.append(string[i])
-            elif 1 <= i <= 3:  # Next 3 positions: A-Z
-                if string[i] in valid_middle:
-                    valid_chars.append(string[i])
-            elif 4 <= i <= 5:  # Last 2 positions: 1-9
-                if string[i] in valid_last:
-                    valid_chars.append(string[i])
-
-        # Count the frequency of valid characters in this position
-        char_count = Counter(valid_chars)
-        print(valid_chars)
-        # If no valid character is found, pick an empty string or a fallback value
-        if char_count:
-            most_common_char = char_count.most_common(1)[0][0]
-        else:
-            most_common_char = ''  # Default to empty string if no valid character
-
-        # Append the result to the voted string
-        voted_string.append(most_common_char)
-
-    # Join the list into a string and return
-    return ''.join(voted_string)
+        logger.error("Error in WebSocket: %s", e)
+    finally:
+        # Keep the partial files and their ranges so the client can resume;
+        # closing them also stops a progressive decoder waiting for data
+        session.cancel_jobs()
+        sessions.detach(session)
+        await sender.close()
+
+
+def requested_detector(data):
+    """
+    Detector asked for in an UPLOAD_START/STREAM_START message, so each
+    camera can use the one that suits it; None for the server default.
+    """
+    detector = data.get('detector')
+    if detector is not None and detector not in DETECTORS:
+        logger.warning("Unknown detector %r, using the default", detector)
+        return None
+    return detector
+
+
+async def run_job(sender, name, job):
+    """
+    Run a video job once admission control lets it through.
+        Parameters:
+            sender (FrameSender): sender of the client connection
+            name (str): name of the video, sent back with queue updates
+            job (function): returns the coroutine processing the video
+    """
+    async def on_queued(position):
+        logger.info("Job %s queued at position %d", name, position)
+        await sender.send_json({'type': 'JOB_QUEUED', 'name': name,
+                                'position': position})
 
+    try:
+        async with admission.admit(on_queued):
+            await sender.send_json({'type': 'JOB_STARTED', 'name': name})
+            await job()
+    except JobRejected as e:
+        logger.warning("Job %s rejected: %s", name, e)
+        await sender.send_json({'type': 'JOB_REJECTED', 'name': name,
+                                'reason': str(e)})
+
+
+async def process_frames(sender, session_id, frames, source_name, trace=False,
+                         detector=None):
+    """
+    Run frames through the worker pipeline, stream the processed frames to
+    the frontend and send each plate as soon as its vote is confident.
+        Parameters:
+            sender (FrameSender): sender of the client connection
+            session_id (str): session of the client, for the scheduler
+            frames: async iterator of (frame_count, frame)
+            source_name (str): name used in the logs
+            trace (bool): save a Chrome trace of the job
+            detector (str): candidate detector, see wrapper.DETECTORS
+    """
+    async def on_result(frame_count, processed_frame, predictions):
+        # Never waits for the client: frames are dropped on congestion
+        sender.submit(processed_frame, frame_count)
+
+    async def on_plate(plate_id, plate, confidence, readings, final):
+        logger.info(
+            "Plate %s: %s (confidence %.2f, %d readings%s)", plate_id, plate,
+            confidence, readings, ", final" if final else "",
+            extra={"plate_id": str(plate_id), "plate": plate,
+                   "confidence": confidence, "final": final})
+        await sender.send_json({
+            "type": "PREDICTIONS",
+            "predictions": [plate],
+            "plate_id": str(plate_id),
+            "confidence": confidence,
+            "final": final,
+        })
 
-async def process_video_data_from_file(websocket, video_file_path):
-    """Process the video file and stream it as encoded video to the frontend."""
+    # Frames are decoded here, analyzed in the worker pool and sent
+    # back in order
+    pipeline = FramePipeline(on_result, on_plate=on_plate, scheduler=scheduler,
+                             session_id=session_id,
+                             trace=source_name if trace else None,
+                             detector=detector)
     try:
-        # Open the video file using OpenCV
-        cap = cv2.VideoCapture(video_file_path)
+        stats = await pipeline.run(frames)
+    except WebSocketDisconnect:
+        logger.info("WebSocket connection closed")
+        return
+
+    logger.info(
+        "Processing of %s completed in %.2f seconds (%s fps, %d plates)",
+        source_name, stats['seconds'], stats['fps'], stats['plates'],
+        extra={"job": source_name, "frames": stats['frames'],
+               "fps": stats['fps'], "plates": stats['plates']})
+    logger.debug("Pipeline stages: %s", stats['stages'])
+    await sender.flush()
+    logger.info("Frame sender: %s", sender.stats())
+    await sender.send_json({
+        "type": "PROCESSING_COMPLETED",
+        "frames": stats['frames'],
+        "fps": stats['fps'],
+        "plates": stats['plates'],
+    })
+    if stats['motion_gate']:
+        logger.info("Motion gate: %s", stats['motion_gate'])
+    if stats['tracker']:
+        logger.info("Plate tracker: %s", stats['tracker'])
+    logger.info("OCR cache: %s", stats['ocr_cache'])
+    if stats['trace']:
+        logger.info("Trace of %s saved to %s", source_name, stats['trace'])
+
+
+async def process_video_data_from_file(sender, session_id, video_file_path=None,
+                                       upload=None, trace=False, detector=None):
+    """
+    Process the video file and stream it as encoded video to the frontend.
+    When `upload` is given the file is still being received: decoding starts
+    once a decodable prefix is on disk and follows the upload.
+    """
+    cap = None
+    try:
+        if upload is not None:
+            video_file_path = upload.filename
+            cap = GrowingFileCapture(upload)
+            if not await asyncio.to_thread(cap.open):
+                logger.error("Could not decode %s progressively", video_file_path)
+                return
+        else:
+            # Open the video file using OpenCV
+            cap = cv2.VideoCapture(video_file_path)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         # Default to 30 FPS if not available
         fps = cap.get(cv2.CAP_PROP_FPS) or 30
         MAX_FRAMES_LEN = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        await websocket.send_json({
+        await sender.send_json({
             "type": "VIDEO_METADATA",
             "width": width,
             "height": height,
@@ -197,75 +370,15 @@ async def process_video_data_from_file(websocket, video_file_path):
             "frame_count": MAX_FRAMES_LEN
         })
 
-        # Create a ThreadPoolExecutor
-        import time
-        start_time = time.time()
-        frames_per_thread = 1
-        frame_count = 0
-        threads = []
-        frames = []
-
-        # Asynchronously process the video frames
-        frames_collector_threads = asyncio.create_task(
-            get_video_frames(cap, frames))
-
-        MAX_THREADS = 10
-        predictions_list = []
-        while len(frames) > 0 or frame_count < MAX_FRAMES_LEN:
-            try:
-                if len(threads) < MAX_THREADS and len(frames) > 0:
-                    thread_frames = frames[:frames_per_thread]
-                    frames = frames[frames_per_thread:]
-                    thread = asyncio.create_task(process_frame_in_thread(
-                        websocket, thread_frames, frame_count, predictions_list=predictions_list))
-                    threads.append(thread)
-                    frame_count += len(thread_frames)
-                else:
-                    await asyncio.sleep(0.01)
-                    threads = [
-                        thread for thread in threads if not thread.done()]
-            except WebSocketDisconnect:
-                logger.info("WebSocket connection closed")
-                break
-            except Exception as e:
-                logger.error(f"Error processing video frames: {e}")
-
-        if not frames_collector_threads.done():
-            frames_collector_threads.cancel()
-        print("Combined Predictions", predictions_list)
-        end_time = time.time()
-        logger.info(
-            f"Video processing completed in {end_time - start_time:.2f} seconds")
-        if predictions_list:
-            result = vote_for_correct_string(predictions_list)
-            await websocket.send_json({
-            "type": "PREDICTIONS",
-            "predictions": [result]
-            })
+        reader = VideoFrameReader(cap)
+        try:
+            await process_frames(sender, session_id, reader, video_file_path,
+                                 trace=trace, detector=detector)
+        finally:
+            reader.close()
 
     except Exception as e:
-        logger.error(f"Error processing video file {video_file_path}: {e}")
+        logger.error("Error processing video file %s: %s", video_file_path, e)
     finally:
-        cap.release()
-
-
-async def get_video_frames(cap, frames):
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-
-
-async def send_frame(websocket, frame, frame_count):
-    """Encode and send the frame to the frontend."""
-    try:
-        if frame is not None:
-            _, buffer = cv2.imencode('.jpg', frame)
-            img_str = buffer.tobytes()
-            await websocket.send_bytes(img_str)
-    except WebSocketDisconnect:
-        logger.info("WebSocket connection closed")
-        raise e
-    except Exception as e:
-        print(f"Error sending frame: {e}")
+        if cap is not None:
+            cap.release()
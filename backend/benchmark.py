@@ -0,0 +1,436 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import resource
+import platform
+import cv2
+import numpy as np
+from wrapper import (
+    process_frame, find_plate_candidates, detect_plate_candidates,
+    DETECTORS, FRAME_TOP_CROP)
+from ocr import OCR
+from finding_contour_plate import findContour
+from deskew_plate import deskew_img
+from segment_characters import segment_characters
+from extract_features import (
+    extract_combined_features, extract_combined_features_batch,
+    CHAR_HEIGHT, CHAR_WIDTH)
+from predict_characters import predict_characters, classify_character_groups
+from feature_store import load_character_image
+from model_registry import warm_up
+from ocr_cache import get_ocr_cache
+from upload_store import BINARY_HEADER, KIND_FRAME
+from plate_tracker import box_iou
+
+
+REPO_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_DATASET = os.path.join(REPO_ROOT, "dataset")
+DEFAULT_CHARACTERS = os.path.join(REPO_ROOT, "data", "characters")
+# Relative slowdown of p50/p95 over the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.15
+SYNTHETIC_PLATES = ["1ABC23", "4XYZ56", "7KLM89", "2DEF34"]
+# Detection scales compared with the full resolution search; "+" joins
+# the levels of a pyramid, e.g. "0.5+0.25"
+DEFAULT_DETECTION_SCALES = "0.75,0.5,0.5+0.25"
+# Overlap for a downscaled detection to count as the same candidate
+DETECTION_MATCH_IOU = 0.5
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageStats:
+    """Latencies of one stage, summarized as percentiles."""
+
+    def __init__(self):
+        self.samples = []
+        self.items = 0
+
+    def add(self, seconds, items=1):
+        self.samples.append(seconds)
+        self.items += items
+
+    def summary(self):
+        if not self.samples:
+            return {"count": 0}
+        samples = np.array(self.samples) * 1000
+        total = samples.sum() / 1000
+        return {
+            "count": len(samples),
+            "items": self.items,
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+            "mean_ms": round(float(samples.mean()), 3),
+            "items_per_s": round(self.items / total, 2) if total else 0.0,
+        }
+
+
+class Benchmark:
+    """Collects per-stage timings of every benchmarked call."""
+
+    def __init__(self, repeats=3):
+        self.repeats = repeats
+        self.stages = {}
+
+    def time(self, stage, function, *args, items=1):
+        """Call `function(*args)` `repeats` times, return the last result."""
+        stats = self.stages.setdefault(stage, StageStats())
+        result = None
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            result = function(*args)
+            stats.add(time.perf_counter() - start, items)
+        return result
+
+    def add(self, stage, seconds, items=1):
+        self.stages.setdefault(stage, StageStats()).add(seconds, items)
+
+    def summary(self):
+        return {stage: stats.summary() for stage, stats in self.stages.items()}
+
+
+def render_plate(text, width=240, height=60):
+    """A white plate with black characters, like the dataset plates."""
+    plate = np.full((height, width, 3), 255, dtype=np.uint8)
+    cv2.rectangle(plate, (2, 2), (width - 3, height - 3), (0, 0, 0), 3)
+    cv2.putText(plate, text, (14, height - 14), cv2.FONT_HERSHEY_SIMPLEX,
+                1.6, (0, 0, 0), 4, cv2.LINE_AA)
+    return plate
+
+
+def synthetic_video(frames=60, width=960, height=540, seed=0,
+                    return_boxes=False):
+    """
+    Frames of rendered plates moving over a noise background.
+        Parameters:
+            return_boxes (bool): also return where the plates are
+        Returns:
+            list(numpy.ndarray): BGR frames, and with return_boxes the
+            (x, y, w, h) plate boxes of each frame, in the coordinates of
+            the frame cropped by FRAME_TOP_CROP
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 160, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (7, 7), 0)
+    plates = [render_plate(text) for text in SYNTHETIC_PLATES[:2]]
+    video, boxes = [], []
+    for i in range(frames):
+        frame = background.copy()
+        # Sensor noise, so no two frames are identical
+        frame = cv2.add(frame, rng.integers(0, 12, frame.shape, dtype=np.uint8))
+        frame_boxes = []
+        for j, plate in enumerate(plates):
+            h, w = plate.shape[:2]
+            x = (40 + 6 * i + 420 * j) % (width - w)
+            y = FRAME_TOP_CROP + 80 + 200 * j
+            frame[y:y + h, x:x + w] = plate
+            frame_boxes.append((x, y - FRAME_TOP_CROP, w, h))
+        video.append(frame)
+        boxes.append(frame_boxes)
+    return (video, boxes) if return_boxes else video
+
+
+def load_images(pattern):
+    return [image for image in (cv2.imread(path) for path in
+                                sorted(glob.glob(pattern)))
+            if image is not None]
+
+
+def load_characters(folder, limit):
+    paths = sorted(glob.glob(os.path.join(folder, "*", "*.png")))
+    step = max(1, len(paths) // limit) if limit else 1
+    return [load_character_image(path, (CHAR_WIDTH, CHAR_HEIGHT))
+            for path in paths[::step][:limit or None]]
+
+
+def plate_crops(frames):
+    """Candidate plate crops of some frames, as process_frame sees them."""
+    crops = []
+    for frame in frames:
+        cropped = frame[FRAME_TOP_CROP:, :]
+        for (x, y, w, h) in find_plate_candidates(cropped):
+            crops.append(cropped[y:y + h, x:x + w].copy())
+    return crops
+
+
+def bench_frames(bench, name, frames):
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        # process_frame draws on the frame: every repeat gets a fresh copy
+        bench.time(f"process_frame/{name}",
+                   lambda frame=frame, i=i: process_frame(frame.copy(), i))
+    elapsed = time.perf_counter() - start
+    return round(len(frames) * bench.repeats / elapsed, 2) if elapsed else 0.0
+
+
+def bench_plates(bench, crops):
+    """OCR and its sub-stages on plate crops."""
+    for crop in crops:
+        bench.time("ocr", OCR, crop)
+        contours, roi = bench.time("find_contour", findContour, crop)
+        if roi is None:
+            continue
+        deskewed = bench.time("deskew", deskew_img, roi, contours)
+        try:
+            characters = bench.time(
+                "segment_characters", lambda: segment_characters(deskewed)[0])
+        except Exception:
+            continue
+        if characters:
+            bench.time("predict_characters", predict_characters, characters,
+                       items=len(characters))
+
+
+def bench_characters(bench, characters, batch_size=6):
+    for character in characters:
+        bench.time("extract_combined_features", extract_combined_features,
+                   character)
+    stack = np.stack(characters) if characters else None
+    for start in range(0, len(characters), batch_size):
+        bench.time("extract_features_batch", extract_combined_features_batch,
+                   stack[start:start + batch_size],
+                   items=len(stack[start:start + batch_size]))
+    groups = [characters[i:i + batch_size]
+              for i in range(0, len(characters), batch_size)]
+    if groups:
+        bench.time("classify_character_groups", classify_character_groups,
+                   groups, items=len(characters))
+
+
+def bench_websocket(bench, frames, quality=80):
+    """
+    Stream frames through the /ws live stream and time the round trip.
+        Returns:
+            dict: frames sent/received and end-to-end fps, or the reason
+            the websocket path was skipped
+    """
+    try:
+        from fastapi.testclient import TestClient
+        from app import app
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    payloads = [cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+                .tobytes() for frame in frames]
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()  # SESSION
+            start = time.perf_counter()
+            websocket.send_json({"type": "STREAM_START"})
+            for i, payload in enumerate(payloads):
+                websocket.send_bytes(BINARY_HEADER.pack(KIND_FRAME, i) + payload)
+            websocket.send_json({"type": "STREAM_END"})
+            received = 0
+            first_frame = None
+            while True:
+                message = websocket.receive()
+                if message.get("bytes") is not None:
+                    received += 1
+                    if first_frame is None:
+                        first_frame = time.perf_counter() - start
+                        bench.add("websocket_first_frame", first_frame)
+                    continue
+                data = json.loads(message["text"])
+                if data.get("type") in ("PROCESSING_COMPLETED", "JOB_REJECTED"):
+                    break
+            elapsed = time.perf_counter() - start
+    bench.add("websocket_stream", elapsed, items=len(frames))
+    return {
+        "frames_sent": len(frames),
+        "frames_received": received,
+        "fps": round(len(frames) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def detection_recall(reference, found, threshold=DETECTION_MATCH_IOU):
+    """Fraction of the reference boxes overlapped by a found box."""
+    if not reference:
+        return None
+    matched = sum(1 for box in reference
+                  if any(box_iou(box, other) >= threshold for other in found))
+    return matched / len(reference)
+
+
+def detection_modes(pyramids=(), detectors=()):
+    """
+    The compared detection modes, the full resolution contour search
+    first.
+        Parameters:
+            pyramids (list(tuple(float))): scales of contour searches
+            detectors (list(str)): other keys of wrapper.DETECTORS
+        Returns:
+            list(tuple): (name, function(frame)) per mode
+    """
+    modes = [("contour", lambda frame: detect_plate_candidates(
+        frame, None, (1.0,)))]
+    for scales in pyramids:
+        name = "contour@" + "+".join(f"{scale:g}" for scale in scales)
+        modes.append((name, lambda frame, scales=tuple(scales):
+                      detect_plate_candidates(frame, None, scales)))
+    for detector in detectors:
+        if detector != "contour":
+            modes.append((detector, lambda frame, detect=DETECTORS[detector]:
+                          detect(frame, None)))
+    return modes
+
+
+def bench_detection(bench, name, frames, modes, truth=None):
+    """
+    Candidate detection of every mode on the same frames.
+        Parameters:
+            modes (list(tuple)): from detection_modes
+            truth (list(list(tuple))): plate boxes of every frame; recall
+                is measured against the first mode's candidates otherwise
+        Returns:
+            dict: mode -> fps, recall and candidates per frame
+    """
+    frames = [frame[FRAME_TOP_CROP:, :] for frame in frames]
+    reference = truth
+    results = {}
+    for mode, detect in modes:
+        stage = f"detection/{mode}/{name}"
+        start = time.perf_counter()
+        found = [bench.time(stage, detect, frame) for frame in frames]
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = found
+        recalls = [recall for recall in map(detection_recall, reference, found)
+                   if recall is not None]
+        results[mode] = {
+            "fps": round(len(frames) * bench.repeats / elapsed, 2)
+            if elapsed else 0.0,
+            "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+            "candidates_per_frame": round(
+                sum(map(len, found)) / len(frames), 2) if frames else 0.0,
+        }
+    return results
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the stages of a report with a baseline report.
+        Returns:
+            list(str): description of every regression
+    """
+    regressions = []
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or not current.get("count"):
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            before, after = previous.get(metric), current.get(metric)
+            if before and after > before * (1 + tolerance):
+                regressions.append(
+                    f"{stage} {metric}: {before} -> {after} ms "
+                    f"(+{100 * (after / before - 1):.0f}%)")
+    return regressions
+
+
+def run(args):
+    warm_up()
+    # Repeated inputs would only measure cache hits
+    get_ocr_cache().max_size = 0
+    bench = Benchmark(repeats=args.repeats)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "cpus": os.cpu_count(),
+            "repeats": args.repeats,
+        },
+        "fps": {},
+    }
+
+    dataset = load_images(os.path.join(args.dataset, "*.png"))
+    video, plate_boxes = synthetic_video(args.frames, return_boxes=True)
+    if dataset:
+        report["fps"]["process_frame/dataset"] = bench_frames(
+            bench, "dataset", dataset)
+    report["fps"]["process_frame/synthetic"] = bench_frames(
+        bench, "synthetic", video)
+
+    pyramids = [[float(scale) for scale in mode.split("+")]
+                for mode in args.detection_scales.split(",") if mode]
+    detectors = [name for name in args.detectors.split(",") if name]
+    modes = detection_modes(pyramids, detectors)
+    if len(modes) > 1:
+        report["detection"] = {
+            "synthetic": bench_detection(bench, "synthetic", video, modes,
+                                         truth=plate_boxes)}
+        if dataset:
+            report["detection"]["dataset"] = bench_detection(
+                bench, "dataset", dataset, modes)
+
+    crops = plate_crops(dataset) + [render_plate(t) for t in SYNTHETIC_PLATES]
+    bench_plates(bench, crops)
+    characters = load_characters(args.characters, args.max_characters)
+    bench_characters(bench, characters)
+
+    if not args.skip_websocket:
+        report["websocket"] = bench_websocket(bench, video)
+
+    report["stages"] = bench.summary()
+    report["peak_rss_bytes"] = peak_rss_bytes()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the plate pipeline stage by stage.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET,
+                        help="folder of full frames (*.png)")
+    parser.add_argument("--characters", default=DEFAULT_CHARACTERS,
+                        help="character dataset, one subfolder per class")
+    parser.add_argument("--max-characters", type=int, default=300,
+                        help="characters sampled from the dataset, 0 for all")
+    parser.add_argument("--frames", type=int, default=60,
+                        help="frames of synthetic video")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="timed calls per input")
+    parser.add_argument("--detection-scales", default=DEFAULT_DETECTION_SCALES,
+                        help="comma separated detection modes compared with "
+                             "full resolution, \"+\" for pyramids; empty "
+                             "to skip")
+    parser.add_argument("--detectors", default=",".join(DETECTORS),
+                        help="comma separated detectors compared with the "
+                             "contour search")
+    parser.add_argument("--skip-websocket", action="store_true",
+                        help="do not benchmark the websocket path")
+    parser.add_argument("--output", default=None,
+                        help="write the JSON report here (stdout otherwise)")
+    parser.add_argument("--baseline", default=None,
+                        help="report to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative slowdown before a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["regressions"] = compare(
+                report, json.load(baseline_file), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text)
+    else:
+        print(text)
+    if report.get("regressions"):
+        print("Regressions:\n  " + "\n  ".join(report["regressions"]),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ import cv2
 import numpy as np
 import logging
 
+logger = logging.getLogger(__name__)
+
 
 def distance(point1, point2):
     """Calculate Euclidean distance between two points."""
@@ -23,7 +25,7 @@ def calculate_left_right_points(corner_points):
 
     bottom_most_idx = 0
     max_y = 0
-    logging.info("finding the bottom most point")
+    # finding the bottom most point
     for idx, point in enumerate(corner_points):
         x, y = point
         if y > max_y:
@@ -33,13 +35,13 @@ def calculate_left_right_points(corner_points):
     prev_idx = bottom_most_idx - 1 if bottom_most_idx > 0 else 3
     next_idx = bottom_most_idx + 1 if bottom_most_idx < 3 else 0
 
-    logging.info("finding the width points of the rectangle")
+    # finding the width points of the rectangle
     distance_to_prev = distance(
         corner_points[bottom_most_idx], corner_points[prev_idx])
     distance_to_next = distance(
         corner_points[bottom_most_idx], corner_points[next_idx])
 
-    logging.info("finding the left/right point of the width")
+    # finding the left/right point of the width
     if distance_to_prev > distance_to_next:
 
         if corner_points[prev_idx][0] < corner_points[bottom_most_idx][0]:
@@ -85,9 +87,9 @@ def deskew_img(cropped_img, contour):
     """
 
     if contour is None:
-        logging.warning("No contour was found")
+        logger.debug("No contour was found")
         return cropped_img
-    logging.info("finding bottom most left and right points")
+    # finding bottom most left and right points
     contour = [item for sublist in contour for item in sublist]
     left, right = calculate_left_right_points(corner_points=contour)
     left_x = contour[left][0]
@@ -95,14 +97,14 @@ def deskew_img(cropped_img, contour):
     right_x = contour[right][0]
     right_y = contour[right][1]
 
-    logging.info("finding the rotation angle")
+    # finding the rotation angle
     angle = find_rotation_angle(left_x, right_x, left_y, right_y)
     if angle > 20:
         return cropped_img
     # width and height (-1) in reverse order
-    logging.info("Get center of image as (width/2)& (height/2)")
+    # Get center of image as (width/2)& (height/2)
     image_center = tuple(np.array(cropped_img.shape[1::-1]) / 2)
-    logging.info("Rotate image")
+    # Rotate image
     rot_mat = cv2.getRotationMatrix2D(image_center, angle, 1.0)
     result = cv2.warpAffine(cropped_img, rot_mat,
                             cropped_img.shape[1::-1], flags=cv2.INTER_LINEAR)
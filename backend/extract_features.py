@@ -1,14 +1,9 @@
 import cv2
-import logging
 import numpy as np
 from skimage.feature import hog
 from skimage.morphology import skeletonize
 
 
-import numpy as np
-import os
-
-
 def calculate_hu_moments(image):
     """Calculate Hu Moments from image."""
 
@@ -69,17 +64,104 @@ def extract_edge_direction_features(image):
     return direction_features
 
 
-def extract_combined_features(image):
-    binary_bool = image.astype(bool)
+CHAR_HEIGHT, CHAR_WIDTH = 42, 28
+ZONING_GRID = (3, 3)
+# Bump when the layout or computation of the feature vector changes
+FEATURE_VERSION = 2
+
+
+def _hog_length(height=CHAR_HEIGHT, width=CHAR_WIDTH):
+    cells_y, cells_x = height // 8, width // 8
+    return (cells_y - 1) * (cells_x - 1) * 2 * 2 * 9
+
+
+HOG_LENGTH = _hog_length()
+HU_LENGTH = 7
+EDGE_LENGTH = CHAR_HEIGHT * CHAR_WIDTH
+ZONING_LENGTH = ZONING_GRID[0] * ZONING_GRID[1]
+FEATURE_LENGTH = HOG_LENGTH + HU_LENGTH + EDGE_LENGTH + ZONING_LENGTH
+
 
-    skeleton = skeletonize(binary_bool)
+def extract_zoning_features_batch(images, grid_size=ZONING_GRID):
+    """
+    Zoning features of a stack of images as a reshape/mean.
+    Like extract_zoning_features, pixels past the last full zone are ignored.
+        Parameters:
+            images (numpy.ndarray): (N, H, W) stack
+        Returns:
+            numpy.ndarray: (N, rows * cols) zoning features
+    """
+    n, height, width = images.shape
+    zone_height = height // grid_size[0]
+    zone_width = width // grid_size[1]
+    zones = images[:, :zone_height * grid_size[0], :zone_width * grid_size[1]]
+    zones = zones.reshape(n, grid_size[0], zone_height,
+                          grid_size[1], zone_width)
+    return zones.mean(axis=(2, 4), dtype=np.float64).reshape(n, -1)
 
-    skeleton_uint8 = (skeleton * 255).astype(np.uint8)
 
-    hu_moments = calculate_hu_moments(skeleton_uint8)
-    hog_features = extract_hog_features(image)
-    edge_dirs = extract_edge_direction_features(image)
-    zoning = extract_zoning_features(image)
-    combined_features = np.hstack(
-        [hog_features, hu_moments, edge_dirs, zoning])  # Combine
-    return combined_features
+def extract_edge_direction_features_batch(images):
+    """
+    Edge direction features of a whole stack at once.
+    Sobel (ksize=3, reflect-101 border, as cv2.Sobel) and the gradient
+    angle are computed in NumPy over the stack.
+        Parameters:
+            images (numpy.ndarray): (N, H, W) stack
+        Returns:
+            numpy.ndarray: (N, H * W) directions scaled to [0, 1)
+    """
+    n = images.shape[0]
+    padded = np.pad(images.astype(np.float32),
+                    ((0, 0), (1, 1), (1, 1)), mode="reflect")
+    # Separable 3x3 Sobel: [1, 2, 1] smoothing and [-1, 0, 1] derivative
+    smooth_rows = padded[:, :-2, :] + 2 * padded[:, 1:-1, :] + padded[:, 2:, :]
+    grad_x = smooth_rows[:, :, 2:] - smooth_rows[:, :, :-2]
+    smooth_cols = padded[:, :, :-2] + 2 * padded[:, :, 1:-1] + padded[:, :, 2:]
+    grad_y = smooth_cols[:, 2:, :] - smooth_cols[:, :-2, :]
+
+    direction = np.degrees(np.arctan2(grad_y, grad_x))
+    direction = np.mod(direction, 360, out=direction)
+    direction /= 360
+    return direction.reshape(n, -1)
+
+
+def extract_combined_features_batch(images, out=None):
+    """
+    Combined HOG, Hu moment, edge direction and zoning features of a stack
+    of binary character images, in the same layout as
+    extract_combined_features.
+        Parameters:
+            images (numpy.ndarray): (N, 42, 28) uint8 stack
+            out (numpy.ndarray): optional (N, FEATURE_LENGTH) float32 buffer
+        Returns:
+            numpy.ndarray: (N, FEATURE_LENGTH) float32 feature matrix
+    """
+    images = np.ascontiguousarray(images, dtype=np.uint8)
+    if images.ndim != 3 or images.shape[1:] != (CHAR_HEIGHT, CHAR_WIDTH):
+        raise ValueError(
+            f"Expected an (N, {CHAR_HEIGHT}, {CHAR_WIDTH}) stack, "
+            f"got {images.shape}")
+    n = images.shape[0]
+    if out is None:
+        out = np.empty((n, FEATURE_LENGTH), dtype=np.float32)
+
+    hog_end = HOG_LENGTH
+    hu_end = hog_end + HU_LENGTH
+    edge_end = hu_end + EDGE_LENGTH
+
+    hog_out = out[:, :hog_end]
+    hu_out = out[:, hog_end:hu_end]
+    for i in range(n):
+        image = images[i]
+        hog_out[i] = extract_hog_features(image)
+        skeleton_uint8 = skeletonize(image.astype(bool)).astype(np.uint8) * 255
+        hu_out[i] = calculate_hu_moments(skeleton_uint8)
+
+    out[:, hu_end:edge_end] = extract_edge_direction_features_batch(images)
+    out[:, edge_end:] = extract_zoning_features_batch(images)
+    return out
+
+
+def extract_combined_features(image):
+    """Combined features of a single 42x28 character image."""
+    return extract_combined_features_batch(image[np.newaxis])[0]
@@ -0,0 +1,234 @@
+import os
+import cv2
+import json
+import hashlib
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from extract_features import (
+    extract_combined_features_batch, FEATURE_VERSION, FEATURE_LENGTH)
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Images per extraction job
+CHUNK_SIZE = 64
+FEATURES_FILE = "features.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def file_digest(path):
+    with open(path, "rb") as image_file:
+        return hashlib.sha1(image_file.read()).hexdigest()
+
+
+def load_character_image(img_path, image_size=(28, 42)):
+    """Read, resize and binarize a character image from the dataset."""
+    image = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    image_resized = cv2.resize(image, image_size)
+    _, binary_img = cv2.threshold(
+        image_resized, 200, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary_img
+
+
+def extract_file_features(paths, image_size):
+    """
+    Load and featurize a chunk of dataset images; runs in a worker.
+        Returns:
+            numpy.ndarray: (len(paths), FEATURE_LENGTH) float32 features
+    """
+    stack = np.empty((len(paths), image_size[1], image_size[0]), dtype=np.uint8)
+    for i, path in enumerate(paths):
+        stack[i] = load_character_image(path, image_size)
+    return extract_combined_features_batch(stack)
+
+
+class FeatureStore:
+    """
+    On-disk cache of the features of a character dataset.
+
+    The features of every image are kept in one .npy matrix, memory-mapped
+    on load, next to a manifest recording for each row the image path,
+    label, mtime, size and SHA-1. On update only images that are new or
+    whose content changed are featurized (in parallel); a change of
+    FEATURE_VERSION or image size rebuilds the whole store.
+    """
+
+    def __init__(self, folder_path, store_path=None, image_size=(28, 42)):
+        """
+            Parameters:
+                folder_path (str): dataset root, one subfolder per class
+                store_path (str): folder of the store, by default
+                    `<folder_path>.features` next to the dataset
+                image_size (tuple): (width, height) images are resized to
+        """
+        self.folder_path = folder_path
+        self.store_path = store_path or (
+            os.path.normpath(folder_path) + ".features")
+        self.image_size = tuple(image_size)
+        self.features_path = os.path.join(self.store_path, FEATURES_FILE)
+        self.manifest_path = os.path.join(self.store_path, MANIFEST_FILE)
+
+    def scan(self):
+        """
+        List the dataset images.
+            Returns:
+                list(tuple): (relative path, label, stat) sorted by path
+        """
+        images = []
+        for label in sorted(os.listdir(self.folder_path)):
+            class_path = os.path.join(self.folder_path, label)
+            if not os.path.isdir(class_path):
+                continue
+            for img_name in sorted(os.listdir(class_path)):
+                if img_name.endswith(IMAGE_EXTENSIONS):
+                    relative_path = os.path.join(label, img_name)
+                    images.append((relative_path, label, os.stat(
+                        os.path.join(self.folder_path, relative_path))))
+        return images
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get("feature_version") != FEATURE_VERSION
+                or manifest.get("feature_length") != FEATURE_LENGTH
+                or tuple(manifest.get("image_size", ())) != self.image_size
+                or not os.path.exists(self.features_path)):
+            logging.info("Feature store %s is outdated, rebuilding",
+                         self.store_path)
+            return None
+        return manifest
+
+    def _write(self, entries, rows):
+        """Write the features matrix and manifest atomically."""
+        os.makedirs(self.store_path, exist_ok=True)
+        tmp_features = f"{self.features_path}.tmp"
+        if entries:
+            features = np.lib.format.open_memmap(
+                tmp_features, mode="w+", dtype=np.float32,
+                shape=(len(entries), FEATURE_LENGTH))
+            for start, block in rows:
+                features[start:start + len(block)] = block
+            features.flush()
+            del features
+        else:
+            with open(tmp_features, "wb") as features_file:
+                np.save(features_file,
+                        np.empty((0, FEATURE_LENGTH), dtype=np.float32))
+        os.replace(tmp_features, self.features_path)
+
+        tmp_manifest = f"{self.manifest_path}.tmp"
+        with open(tmp_manifest, "w") as manifest_file:
+            json.dump({
+                "feature_version": FEATURE_VERSION,
+                "feature_length": FEATURE_LENGTH,
+                "image_size": list(self.image_size),
+                "entries": entries,
+            }, manifest_file)
+        os.replace(tmp_manifest, self.manifest_path)
+
+    def update(self, workers=None):
+        """
+        Bring the store up to date with the dataset folder.
+            Parameters:
+                workers (int): extraction processes, one per core by
+                    default; 1 extracts in this process
+            Returns:
+                dict: number of images reused and extracted
+        """
+        manifest = self._load_manifest()
+        old_entries = {}
+        old_features = None
+        if manifest is not None:
+            old_entries = {entry["path"]: (row, entry)
+                           for row, entry in enumerate(manifest["entries"])}
+            old_features = np.load(self.features_path, mmap_mode="r")
+
+        entries = []
+        reused = []
+        to_extract = []
+        for relative_path, label, stat in self.scan():
+            entry = {"path": relative_path, "label": label,
+                     "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+            row, old = old_entries.get(relative_path, (None, None))
+            if old is not None and old["size"] == stat.st_size:
+                if old["mtime_ns"] == stat.st_mtime_ns:
+                    entry["sha1"] = old["sha1"]
+                else:
+                    # Touched: only re-extract if the content changed
+                    entry["sha1"] = file_digest(
+                        os.path.join(self.folder_path, relative_path))
+                    if entry["sha1"] != old["sha1"]:
+                        row = None
+            else:
+                row = None
+            if row is None:
+                entry["sha1"] = entry.get("sha1") or file_digest(
+                    os.path.join(self.folder_path, relative_path))
+                to_extract.append(len(entries))
+            else:
+                reused.append((len(entries), row))
+            entries.append(entry)
+
+        unchanged = (manifest is not None and not to_extract
+                     and [entry["path"] for entry in manifest["entries"]]
+                     == [entry["path"] for entry in entries]
+                     and all(old_entries[e["path"]][1] == e for e in entries))
+        if unchanged:
+            return {"images": len(entries), "reused": len(entries), "extracted": 0}
+
+        rows = []
+        # Reused rows are copied in runs of consecutive indices
+        run_start = None
+        for i, (index, row) in enumerate(reused):
+            if run_start is None:
+                run_start = i
+            last = i + 1 == len(reused)
+            if last or reused[i + 1] != (index + 1, row + 1):
+                first_index, first_row = reused[run_start]
+                rows.append((first_index,
+                             np.asarray(old_features[first_row:row + 1])))
+                run_start = None
+        rows.extend(self._extract(entries, to_extract, workers))
+        del old_features
+        self._write(entries, rows)
+        logging.info("Feature store %s: %d images, %d extracted",
+                     self.store_path, len(entries), len(to_extract))
+        return {"images": len(entries), "reused": len(reused),
+                "extracted": len(to_extract)}
+
+    def _extract(self, entries, indices, workers=None):
+        """Featurize the images at `indices`, yielding (index, block) runs."""
+        chunks = [indices[i:i + CHUNK_SIZE]
+                  for i in range(0, len(indices), CHUNK_SIZE)]
+        paths = [[os.path.join(self.folder_path, entries[i]["path"])
+                  for i in chunk] for chunk in chunks]
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(chunks) <= 1:
+            blocks = [extract_file_features(chunk_paths, self.image_size)
+                      for chunk_paths in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                blocks = list(executor.map(
+                    extract_file_features, paths,
+                    [self.image_size] * len(paths)))
+        # Chunks are not contiguous in the store; scatter row by row
+        return [(index, block[j:j + 1])
+                for chunk, block in zip(chunks, blocks)
+                for j, index in enumerate(chunk)]
+
+    def load(self, workers=None):
+        """
+        Update the store and return the dataset.
+            Returns:
+                tuple: (X, y) with X the memory-mapped (N, D) float32
+                feature matrix and y the labels
+        """
+        self.update(workers)
+        with open(self.manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        X = np.load(self.features_path, mmap_mode="r")
+        y = np.array([entry["label"] for entry in manifest["entries"]])
+        return X, y
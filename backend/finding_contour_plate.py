@@ -1,6 +1,8 @@
 import cv2
 import logging
 
+logger = logging.getLogger(__name__)
+
 
 def findContour(img):
     """
@@ -14,24 +16,23 @@ def findContour(img):
                 Region of Intrest (numpy.ndarray): the cropped licence plate image
     """
 
-    logging.info("Converting image to grayscale.")
+    # Converting image to grayscale.
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-    logging.info("Applying bilateral filter")
+    # Applying bilateral filter
     gray = cv2.bilateralFilter(gray, 7, 17, 17)
 
-    logging.info("Applying Canny edge detection")
+    # Applying Canny edge detection
     edged = cv2.Canny(gray, 170, 200)
 
-    logging.info("Finding contours of the edges-only image")
+    # Finding contours of the edges-only image
     cnts = cv2.findContours(edged.copy(), cv2.RETR_LIST,
                             cv2.CHAIN_APPROX_SIMPLE)[0]
 
-    logging.info("kgetiing the largest 30 contours")
+    # keeping the largest 30 contours
     cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:30]
     NumberPlateContour = None
-    logging.info(
-        "finding first closed contour and applying a bounding rectange to it")
+    # finding first closed contour and applying a bounding rectange to it
 
     for c in cnts:
         perimeter = cv2.arcLength(c, closed=True)
@@ -42,5 +43,5 @@ def findContour(img):
             ROI = img[y:y+h, x:x+w].copy()
             return (NumberPlateContour, ROI)
 
-    logging.warning("No contour with 4 corners found.")
+    logger.debug("No contour with 4 corners found.")
     return None, None
@@ -0,0 +1,363 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from model_registry import warm_up
+from motion_gate import MotionGate, MOTION_GATE_ENABLED
+from plate_tracker import PlateTracker, TRACKER_ENABLED
+from plate_voter import VoteBook
+from wrapper import analyze_frame, FRAME_TOP_CROP, DETECTOR
+from haar_detector import get_cascade
+from ocr_cache import get_ocr_cache
+import metrics
+from metrics import registry, TraceRecorder
+
+
+# Detection/OCR worker processes, sized to the cores by default
+DEFAULT_WORKERS = int(os.environ.get("CARLENS_WORKERS", os.cpu_count() or 1))
+# Decoded frames waiting for a worker
+DEFAULT_QUEUE_SIZE = int(os.environ.get("CARLENS_QUEUE_SIZE", "16"))
+
+_executor = None
+_executor_workers = 0
+
+
+def _init_worker():
+    """Load the character model (and cascade) once when a worker starts."""
+    metrics.set_worker_mode()
+    try:
+        warm_up()
+        if DETECTOR == "haar":
+            get_cascade()
+    except OSError as e:
+        logging.error("Worker %d could not load the model: %s",
+                      os.getpid(), e)
+
+
+def analyze_frame_job(frame, frame_count, regions=None, skip_boxes=(),
+                      detector=None):
+    """
+    Run detection and OCR on one frame inside a worker process.
+        Parameters:
+            detector (str): key of wrapper.DETECTORS, the process default
+                (CARLENS_DETECTOR) when None
+        Returns:
+            tuple: (processed_frame, detections, info), see
+            wrapper.analyze_frame; info holds the seconds spent, the OCR
+            cache hits and misses, and the stage spans of the worker
+    """
+    start = time.perf_counter()
+    cache = get_ocr_cache()
+    hits, misses = cache.hits, cache.misses
+    try:
+        processed_frame, detections = analyze_frame(
+            frame, frame_count, regions, skip_boxes, detector or DETECTOR)
+    except Exception as e:
+        logging.error("Error processing frame %d: %s", frame_count, e)
+        processed_frame, detections = None, []
+    return processed_frame, detections, {
+        "seconds": time.perf_counter() - start,
+        "cache_hits": cache.hits - hits,
+        "cache_misses": cache.misses - misses,
+        "spans": metrics.drain(),
+        "pid": os.getpid(),
+    }
+
+
+def get_executor(workers=None):
+    """Return the shared process pool, creating it on first use."""
+    global _executor, _executor_workers
+    if _executor is None:
+        workers = workers or DEFAULT_WORKERS
+        _executor = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=_init_worker)
+        _executor_workers = workers
+        logging.info("Started frame worker pool with %d processes", workers)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class StageTimer:
+    """
+    Accumulates call count, total and maximum duration per stage, feeds
+    the process-wide stage histograms and, for a traced job, its trace.
+    """
+
+    def __init__(self, trace=None):
+        self.stages = {}
+        self.trace = trace
+
+    def add(self, stage, seconds):
+        count, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+        self.stages[stage] = (count + 1, total + seconds, max(longest, seconds))
+        registry.observe(stage, seconds)
+
+    def since(self, stage, start):
+        """Record the time elapsed since `start` (a perf_counter value)."""
+        seconds = time.perf_counter() - start
+        self.add(stage, seconds)
+        if self.trace is not None:
+            self.trace.add(stage, start, seconds)
+
+    def summary(self):
+        return {
+            stage: {
+                "count": count,
+                "total_s": round(total, 4),
+                "mean_ms": round(1000 * total / count, 3) if count else 0.0,
+                "max_ms": round(1000 * longest, 3),
+            }
+            for stage, (count, total, longest) in self.stages.items()
+        }
+
+
+class FramePipeline:
+    """
+    decoder -> bounded queue -> process pool -> ordered re-sequencer -> sender
+
+    The decoder pulls frames from an async iterator into a bounded queue.
+    If the iterator has a `release(frame_count)` method (VideoFrameReader),
+    it is called as soon as a worker is done with the frame so its buffer
+    can be reused.
+    The dispatcher submits them to the process pool and keeps the pending
+    futures in a second bounded FIFO, which caps the frames in flight and
+    preserves submission order. The re-sequencer awaits the futures in
+    that order and hands each result to `on_result`. A slow sender
+    therefore stalls the dispatcher, which stalls the decoder. With a
+    motion gate, static frames bypass the pool and moving ones are only
+    searched in the regions that changed. With a tracker, detections are
+    associated to plate tracks in frame order and the next frames skip OCR
+    on plates that are already read. With a scheduler, each frame waits
+    for a slot shared with the other sessions before it is submitted, so
+    concurrent videos get the pool in turns.
+    """
+
+    def __init__(self, on_result, executor=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_in_flight=None, motion_gate=MOTION_GATE_ENABLED,
+                 tracker=TRACKER_ENABLED, on_plate=None, scheduler=None,
+                 session_id=None, trace=None, detector=None):
+        """
+            Parameters:
+                on_result (coroutine function): called as
+                    on_result(frame_count, processed_frame, predictions)
+                executor (Executor): pool running analyze_frame_job
+                queue_size (int): decoded frames buffered ahead of the pool
+                max_in_flight (int): frames submitted but not yet sent
+                motion_gate (bool or MotionGate): skip static frames and
+                    limit detection to the regions that changed
+                tracker (bool or PlateTracker): follow plates across frames,
+                    stop OCRing confidently read plates and only search
+                    around tracked plates between full detections
+                on_plate (coroutine function): called as
+                    on_plate(plate_id, plate, confidence, readings, final)
+                    as soon as the vote of a plate is confident, and at the
+                    end for plates that never got there
+                scheduler (FairScheduler): shares the pool with the other
+                    sessions; frames are submitted once it grants a slot
+                session_id (str): key of this pipeline in the scheduler
+                trace (str): if given, a Chrome trace of the job is saved
+                    under this name in metrics.TRACE_DIR
+                detector (str): candidate detector of this video, a key
+                    of wrapper.DETECTORS; the server default when None
+        """
+        self.on_result = on_result
+        self.executor = executor or get_executor()
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or 2 * (
+            _executor_workers or DEFAULT_WORKERS)
+        if motion_gate is True:
+            motion_gate = MotionGate()
+        self.motion_gate = motion_gate or None
+        if tracker is True:
+            tracker = PlateTracker()
+        self.tracker = tracker or None
+        # Readings are voted per track, or grouped by similarity without
+        # a tracker
+        self.votes = (self.tracker.votes if self.tracker is not None
+                      else VoteBook())
+        self.on_plate = on_plate
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.detector = detector
+        self.trace = TraceRecorder(trace) if trace else None
+        self.timer = StageTimer(self.trace)
+        self.frames_processed = 0
+        self.plates_emitted = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    async def _decode(self, frames, decoded):
+        iterator = frames.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                frame_count, frame = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            self.timer.since("decode", start)
+            start = time.perf_counter()
+            await decoded.put((frame_count, frame))
+            self.timer.since("decode_backpressure", start)
+        await decoded.put(None)
+
+    async def _dispatch(self, decoded, in_flight, release):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await decoded.get()
+            if item is None:
+                break
+            frame_count, frame = item
+            cropped = frame[FRAME_TOP_CROP:, :]
+
+            regions = None
+            if self.motion_gate is not None:
+                start = time.perf_counter()
+                analyze, regions = self.motion_gate.check(cropped)
+                self.timer.since("motion_gate", start)
+                if not analyze:
+                    # Static frame: sent as is, from a copy so that its
+                    # buffer can be reused right away
+                    future = loop.create_future()
+                    future.set_result((cropped.copy(), [], None))
+                    if release is not None:
+                        release(frame_count)
+                    await in_flight.put((frame_count, future, True))
+                    continue
+
+            skip_boxes = ()
+            if self.tracker is not None:
+                tracked_regions, skip_boxes = self.tracker.plan(
+                    frame_count, cropped.shape)
+                if tracked_regions is not None:
+                    regions = tracked_regions
+
+            if self.scheduler is not None:
+                start = time.perf_counter()
+                await self.scheduler.acquire(self.session_id)
+                self.timer.since("schedule_wait", start)
+            future = loop.run_in_executor(
+                self.executor, analyze_frame_job, frame, frame_count,
+                regions, skip_boxes, self.detector)
+            if self.scheduler is not None:
+                future.add_done_callback(
+                    lambda _: self.scheduler.release())
+            if release is not None:
+                # The frame has been pickled to the worker once it finishes
+                future.add_done_callback(
+                    lambda _, frame_count=frame_count: release(frame_count))
+            start = time.perf_counter()
+            await in_flight.put((frame_count, future, False))
+            self.timer.since("dispatch_backpressure", start)
+        await in_flight.put(None)
+
+    async def _resequence(self, in_flight):
+        while True:
+            item = await in_flight.get()
+            if item is None:
+                break
+            frame_count, future, skipped = item
+            start = time.perf_counter()
+            try:
+                processed_frame, detections, info = await future
+            except Exception as e:
+                logging.error("Frame %d failed in worker: %s", frame_count, e)
+                continue
+            self.timer.since("wait_result", start)
+            predictions = [text for _, text in detections if text]
+            readings = []
+            if not skipped:
+                self._record_job(frame_count, info)
+                if self.tracker is not None:
+                    readings = self.tracker.update(frame_count, detections)
+                else:
+                    readings = [self.votes.add(text) for text in predictions]
+
+            start = time.perf_counter()
+            await self.on_result(frame_count, processed_frame, predictions)
+            self.timer.since("send", start)
+            self.frames_processed += 1
+            registry.inc("frames", skipped="true" if skipped else "false")
+
+            for plate_id, voter in readings:
+                if self.votes.ready(voter):
+                    await self._emit_plate(plate_id, voter, final=False)
+            if self.tracker is not None:
+                # A plate that left the frame gets no more readings: its
+                # vote is reported now, like at the end of the video
+                for track in self.tracker.pop_finished():
+                    voter = self.votes.finish(track.track_id, min_readings=2)
+                    if voter is not None:
+                        await self._emit_plate(track.track_id, voter,
+                                               final=True)
+
+    def _record_job(self, frame_count, info):
+        """Account the timings and cache counts returned by a worker."""
+        self.timer.add("process", info["seconds"])
+        self.cache_hits += info["cache_hits"]
+        self.cache_misses += info["cache_misses"]
+        registry.inc("ocr_cache_hits", info["cache_hits"])
+        registry.inc("ocr_cache_misses", info["cache_misses"])
+        for stage, start, seconds in info["spans"]:
+            registry.observe(stage, seconds)
+            if self.trace is not None:
+                self.trace.add(stage, start, seconds, pid=info["pid"],
+                               frame=frame_count)
+
+    async def _emit_plate(self, plate_id, voter, final):
+        self.plates_emitted += 1
+        registry.inc("plates", final="true" if final else "false")
+        if self.on_plate is not None:
+            await self.on_plate(plate_id, voter.best(), voter.confidence(),
+                                voter.readings, final)
+
+    async def run(self, frames):
+        """
+        Process every frame of `frames` (async iterator of
+        (frame_count, frame)) and return the per-stage timing summary.
+        """
+        decoded = asyncio.Queue(maxsize=self.queue_size)
+        in_flight = asyncio.Queue(maxsize=self.max_in_flight)
+        start = time.perf_counter()
+        release = getattr(frames, "release", None)
+        tasks = [
+            asyncio.create_task(self._decode(frames, decoded)),
+            asyncio.create_task(self._dispatch(decoded, in_flight, release)),
+            asyncio.create_task(self._resequence(in_flight)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        # Plates that never reached a confident vote are sent at the end,
+        # unless they were read only once
+        for plate_id, voter in self.votes.pending(min_readings=2):
+            await self._emit_plate(plate_id, voter, final=True)
+        elapsed = time.perf_counter() - start
+        lookups = self.cache_hits + self.cache_misses
+        trace_path = self.trace.save() if self.trace is not None else None
+        return {
+            "trace": trace_path,
+            "frames": self.frames_processed,
+            "seconds": round(elapsed, 3),
+            "fps": round(self.frames_processed / elapsed, 2) if elapsed else 0.0,
+            "plates": self.plates_emitted,
+            "stages": self.timer.summary(),
+            "motion_gate": (self.motion_gate.stats()
+                            if self.motion_gate is not None else None),
+            "tracker": (self.tracker.stats()
+                        if self.tracker is not None else None),
+            "ocr_cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate": round(self.cache_hits / lookups, 4)
+                if lookups else 0.0,
+            },
+        }
@@ -0,0 +1,143 @@
+import os
+import cv2
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, registry
+
+
+JPEG_QUALITY = int(os.environ.get("CARLENS_JPEG_QUALITY", "80"))
+# Downscale factor of the frames sent to the viewer
+SEND_SCALE = float(os.environ.get("CARLENS_SEND_SCALE", "1.0"))
+# Encoded frames waiting for the socket before older ones are dropped
+SEND_QUEUE_SIZE = int(os.environ.get("CARLENS_SEND_QUEUE", "2"))
+ENCODE_THREADS = int(os.environ.get("CARLENS_ENCODE_THREADS", "2"))
+
+# cv2.imencode releases the GIL, so a small thread pool encodes in parallel
+_encode_pool = ThreadPoolExecutor(max_workers=ENCODE_THREADS,
+                                  thread_name_prefix="frame-encoder")
+
+
+def encode_frame(frame, quality=JPEG_QUALITY, scale=SEND_SCALE):
+    """
+    Downscale and JPEG-encode a frame.
+        Returns:
+            bytes: the encoded image, or None if encoding failed
+    """
+    with span("encode"):
+        return _encode(frame, quality, scale)
+
+
+def _encode(frame, quality, scale):
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(
+        '.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return buffer.tobytes() if ok else None
+
+
+class FrameSender:
+    """
+    Sends processed frames to one websocket without ever blocking analysis.
+
+    `submit` only queues the frame; a background task encodes it in the
+    thread pool and sends it. When the client is slower than the analysis
+    the queue keeps the `max_pending` latest frames and drops the older
+    ones. JSON messages go through the same lock so that frames and
+    control messages never interleave on the socket.
+    """
+
+    def __init__(self, websocket, quality=JPEG_QUALITY, scale=SEND_SCALE,
+                 max_pending=SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.quality = quality
+        self.scale = scale
+        self.max_pending = max_pending
+        self.sent = 0
+        self.dropped = 0
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self.error = None
+
+    def configure(self, quality=None, scale=None):
+        if quality is not None:
+            self.quality = max(1, min(100, int(quality)))
+        if scale is not None:
+            self.scale = max(0.05, min(1.0, float(scale)))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, frame, frame_count):
+        """Queue a frame for sending, dropping the oldest on congestion."""
+        if frame is None:
+            return
+        if self.error is not None:
+            raise self.error
+        self.start()
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+            registry.inc("frames_dropped")
+        self._pending.append((frame_count, frame))
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                if not self._pending:
+                    self._idle.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                frame_count, frame = self._pending.popleft()
+                data = await loop.run_in_executor(
+                    _encode_pool, encode_frame, frame, self.quality, self.scale)
+                if data is None:
+                    logging.error("Could not encode frame %d", frame_count)
+                    continue
+                async with self._lock:
+                    with span("socket_send"):
+                        await self.websocket.send_bytes(data)
+                self.sent += 1
+                registry.inc("frames_sent")
+        except Exception as e:
+            # Usually a closed socket; reported to the next submit
+            self.error = e
+            self._pending.clear()
+            self._idle.set()
+
+    async def send_json(self, message):
+        async with self._lock:
+            await self.websocket.send_json(message)
+
+    async def flush(self):
+        """Wait until every queued frame has been sent or dropped."""
+        if self._task is not None and not self._task.done():
+            await self._idle.wait()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "quality": self.quality,
+            "scale": self.scale,
+        }
@@ -0,0 +1,272 @@
+import os
+import cv2
+import queue
+import asyncio
+import logging
+import threading
+import numpy as np
+
+
+# Decoded frames held in memory at once, per video
+DEFAULT_RING_SIZE = int(os.environ.get("CARLENS_DECODE_BUFFERS", "32"))
+_END = object()
+
+
+class FrameRing:
+    """
+    A fixed set of reusable frame buffers.
+    The reader acquires a free slot before decoding into it and consumers
+    release the slot once they are done with the frame, so at most
+    `capacity` decoded frames exist at any time.
+    """
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE):
+        self.capacity = capacity
+        self.buffers = [None] * capacity
+        self._free = queue.Queue()
+        for slot in range(capacity):
+            self._free.put(slot)
+
+    def acquire(self, timeout=None):
+        """
+        Take a free slot, blocking while every buffer is in use.
+            Returns:
+                int: slot index, or None on timeout
+        """
+        try:
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def in_use(self):
+        return self.capacity - self._free.qsize()
+
+
+class VideoFrameReader:
+    """
+    Decodes a cv2.VideoCapture on a background thread into a FrameRing.
+
+    Iterate with `async for frame_count, frame in reader` and call
+    `reader.release(frame_count)` when a frame is no longer needed. The
+    decoding thread blocks when all buffers are taken, so a lagging
+    consumer throttles decoding instead of growing memory.
+    """
+
+    def __init__(self, cap, capacity=DEFAULT_RING_SIZE):
+        self.cap = cap
+        self.ring = FrameRing(capacity)
+        self.frames_decoded = 0
+        self._slots = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._ready = None
+        self._loop = None
+
+    def _publish(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.put_nowait, item)
+        except RuntimeError:
+            # The event loop is gone, nobody is consuming anymore
+            self._stop.set()
+
+    def _read_loop(self):
+        try:
+            frame_count = 0
+            while not self._stop.is_set():
+                slot = self.ring.acquire(timeout=0.5)
+                if slot is None:
+                    continue
+                buffer = self.ring.buffers[slot]
+                if buffer is None:
+                    ret, frame = self.cap.read()
+                else:
+                    # Decode in place into the preallocated buffer
+                    ret, frame = self.cap.read(buffer)
+                if not ret:
+                    self.ring.release(slot)
+                    break
+                self.ring.buffers[slot] = frame
+                self._slots[frame_count] = slot
+                self._publish((frame_count, frame))
+                frame_count += 1
+            self.frames_decoded = frame_count
+        except Exception as e:
+            logging.error("Error decoding video: %s", e)
+        finally:
+            self._publish(_END)
+
+    def start(self):
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._ready = asyncio.Queue()
+            self._thread = threading.Thread(
+                target=self._read_loop, name="frame-reader", daemon=True)
+            self._thread.start()
+
+    async def __aiter__(self):
+        self.start()
+        while True:
+            item = await self._ready.get()
+            if item is _END:
+                return
+            yield item
+
+    def release(self, frame_count):
+        """Return the buffer of `frame_count` to the ring."""
+        slot = self._slots.pop(frame_count, None)
+        if slot is not None:
+            self.ring.release(slot)
+
+    def close(self):
+        """Stop the decoding thread; safe to call more than once."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+
+# Bytes of the upload on disk before a progressive decode is attempted
+PROGRESSIVE_MIN_BYTES = int(
+    os.environ.get("CARLENS_PROGRESSIVE_MIN_BYTES", str(2 * 1024 * 1024)))
+# Encoded frames of a live stream waiting to be decoded
+LIVE_QUEUE_SIZE = int(os.environ.get("CARLENS_LIVE_QUEUE_SIZE", "32"))
+
+
+class GrowingFileCapture:
+    """
+    cv2.VideoCapture over an Upload that is still being received.
+
+    The capture is opened as soon as a contiguous prefix of the file is on
+    disk. When the decoder runs out of data before the upload is finished,
+    it waits for more bytes, reopens the file and seeks back to the next
+    frame. Streamable containers (fragmented MP4, MKV/WebM, AVI, MPEG-TS,
+    raw H.264) decode progressively; an MP4 with its index at the end only
+    opens once the upload is complete.
+    """
+
+    def __init__(self, upload, min_bytes=PROGRESSIVE_MIN_BYTES,
+                 poll_interval=0.5):
+        self.upload = upload
+        self.min_bytes = min_bytes
+        self.poll_interval = poll_interval
+        self.cap = None
+        self.frames_read = 0
+        self._opened_prefix = 0
+        self._opened_complete = False
+
+    def _open_capture(self):
+        if self.cap is not None:
+            self.cap.release()
+        self._opened_complete = self.upload.completed
+        self._opened_prefix = self.upload.contiguous_prefix()
+        self.cap = cv2.VideoCapture(self.upload.current_path())
+        if self.cap.isOpened() and self.frames_read:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames_read)
+        return self.cap.isOpened()
+
+    def _upload_gone(self):
+        return self.upload.fd is None and not self.upload.completed
+
+    def open(self):
+        """
+        Block until enough of the file is on disk to open a decoder.
+            Returns:
+                bool: True if the capture could be opened
+        """
+        wanted = self.min_bytes
+        while True:
+            self.upload.wait_for_prefix(min(wanted, self.upload.size))
+            if self._upload_gone():
+                return False
+            if self._open_capture() or self._opened_complete:
+                return self.cap.isOpened()
+            # Not decodable yet (e.g. headers at the end), wait for more
+            wanted = self._opened_prefix * 2
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop) if self.cap is not None else 0
+
+    def read(self, image=None):
+        while True:
+            if image is not None:
+                ret, frame = self.cap.read(image)
+            else:
+                ret, frame = self.cap.read()
+            if ret:
+                self.frames_read += 1
+                return ret, frame
+            if self._opened_complete:
+                return False, None
+            self.upload.wait_for_prefix(
+                self._opened_prefix + 1, timeout=self.poll_interval)
+            if self._upload_gone():
+                return False, None
+            if (self.upload.completed
+                    or self.upload.contiguous_prefix() > self._opened_prefix):
+                self._open_capture()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+def decode_image(data):
+    """Decode an encoded (JPEG/PNG) frame, None if it is not an image."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+class LiveFrameSource:
+    """
+    Frames pushed by the client one by one as encoded images.
+    `push` never waits, so the websocket receive loop keeps serving the
+    other messages: when LIVE_QUEUE_SIZE frames are pending, the oldest is
+    dropped, a live viewer wants the latest frame. Once closed (its job
+    ended or was rejected) every frame is dropped.
+    """
+
+    def __init__(self, max_pending=LIVE_QUEUE_SIZE):
+        self._pending = asyncio.Queue(maxsize=max_pending)
+        self.closed = False
+        self.dropped = 0
+
+    def _put(self, item):
+        if self._pending.full():
+            self._pending.get_nowait()
+            self.dropped += 1
+        self._pending.put_nowait(item)
+
+    def push(self, frame_count, data):
+        if self.closed:
+            self.dropped += 1
+            return
+        self._put((frame_count, bytes(data)))
+
+    def end(self):
+        """No more frames: the iteration stops after the pending ones."""
+        if not self.closed:
+            self._put(None)
+            self.closed = True
+
+    def close(self):
+        """Drop the pending frames and every frame pushed from now on."""
+        self.closed = True
+        while not self._pending.empty():
+            self._pending.get_nowait()
+
+    async def __aiter__(self):
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            frame_count, data = item
+            frame = await asyncio.to_thread(decode_image, data)
+            if frame is None:
+                logging.error("Could not decode live frame %d", frame_count)
+                continue
+            yield frame_count, frame
@@ -0,0 +1,83 @@
+import os
+import cv2
+
+
+REPO_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+HAAR_CASCADE_PATH = os.environ.get("CARLENS_HAAR_CASCADE", os.path.join(
+    REPO_ROOT, "Plates Extractor", "haarcascade_russian_plate_number.xml"))
+# Image pyramid step of detectMultiScale; larger is faster, misses more
+HAAR_SCALE_FACTOR = float(os.environ.get("CARLENS_HAAR_SCALE_FACTOR", "1.1"))
+HAAR_MIN_NEIGHBORS = int(os.environ.get("CARLENS_HAAR_MIN_NEIGHBORS", "4"))
+# Smallest plate searched for, "WIDTHxHEIGHT" in pixels
+HAAR_MIN_SIZE = tuple(int(size) for size in os.environ.get(
+    "CARLENS_HAAR_MIN_SIZE", "60x15").split("x"))
+# Fixed "x,y,w,h" area of the cropped frame a camera sees plates in; the
+# whole frame when empty
+HAAR_ROI = tuple(int(value) for value in os.environ.get(
+    "CARLENS_HAAR_ROI", "").split(",") if value) or None
+
+
+_cascade = None
+
+
+def get_cascade(path=HAAR_CASCADE_PATH):
+    """The plate cascade, loaded once per process."""
+    global _cascade
+    if _cascade is None:
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise OSError(f"Could not load the Haar cascade {path}")
+        _cascade = cascade
+    return _cascade
+
+
+def find_haar_plates(frame, regions=None, scale_factor=HAAR_SCALE_FACTOR,
+                     min_neighbors=HAAR_MIN_NEIGHBORS, min_size=HAAR_MIN_SIZE,
+                     roi=HAAR_ROI):
+    """
+    Plate candidates from the bundled Haar cascade.
+        Parameters:
+            frame (numpy.ndarray): BGR frame (already cropped)
+            regions (list(tuple)): optional (x, y, w, h) areas to search
+            scale_factor, min_neighbors, min_size: see
+                cv2.CascadeClassifier.detectMultiScale
+            roi (tuple): (x, y, w, h) the search is restricted to; regions
+                outside of it are ignored
+        Returns:
+            list(tuple): (x, y, w, h) of every candidate, in frame coordinates
+    """
+    if roi is not None:
+        if regions is None:
+            regions = [roi]
+        else:
+            regions = [clipped for clipped in (intersect(region, roi)
+                                               for region in regions)
+                       if clipped is not None]
+    if regions is not None:
+        locations = []
+        for (rx, ry, rw, rh) in regions:
+            for (x, y, w, h) in find_haar_plates(
+                    frame[ry:ry + rh, rx:rx + rw], None, scale_factor,
+                    min_neighbors, min_size, None):
+                location = (x + rx, y + ry, w, h)
+                if location not in locations:
+                    locations.append(location)
+        return locations
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if gray.shape[0] < min_size[1] or gray.shape[1] < min_size[0]:
+        return []
+    plates = get_cascade().detectMultiScale(
+        gray, scaleFactor=scale_factor, minNeighbors=min_neighbors,
+        minSize=min_size)
+    return [tuple(int(value) for value in plate) for plate in plates]
+
+
+def intersect(a, b):
+    """Intersection of two (x, y, w, h) boxes, None if they do not overlap."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1 = min(a[0] + a[2], b[0] + b[2])
+    y1 = min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
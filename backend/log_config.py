@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import logging
+
+
+# Level of every logger without its own entry in LOG_LEVELS
+LOG_LEVEL = os.environ.get("CARLENS_LOG_LEVEL", "WARNING")
+# Per-module levels, e.g. "app=INFO,segment_characters=DEBUG"; job-level
+# summaries come from app and are kept at INFO by default
+LOG_LEVELS = os.environ.get("CARLENS_LOG_LEVELS", "app=INFO,__main__=INFO")
+# Only one in N DEBUG records of a given call site is written
+LOG_DEBUG_SAMPLE = int(os.environ.get("CARLENS_LOG_DEBUG_SAMPLE", "100"))
+# "text" or "json" (one object per line)
+LOG_FORMAT = os.environ.get("CARLENS_LOG_FORMAT", "text")
+
+# Attributes every LogRecord has; anything else was passed with `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class SampledDebugFilter(logging.Filter):
+    """
+    Lets through every record at INFO and above, and one in `every` DEBUG
+    records per call site, so per-frame debug output stays readable.
+    The logger level check happens before, so disabled DEBUG calls never
+    reach the filter.
+    """
+
+    def __init__(self, every=LOG_DEBUG_SAMPLE):
+        super().__init__()
+        self.every = max(1, every)
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        site = (record.name, record.lineno)
+        count = self.seen.get(site, 0)
+        self.seen[site] = count + 1
+        return count % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed in `extra`."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(spec):
+    """Parse "module=LEVEL,..." into {module: level}."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_configured = False
+
+
+def configure_logging(level=LOG_LEVEL, levels=LOG_LEVELS, fmt=LOG_FORMAT,
+                      debug_sample=LOG_DEBUG_SAMPLE):
+    """
+    Set up the root handler once per process; worker processes forked
+    afterwards inherit it.
+        Parameters:
+            level (str): default level
+            levels (str or dict): per-module levels
+            fmt (str): "text" or "json"
+            debug_sample (int): keep one in N DEBUG records per call site
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s")
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+    handler.addFilter(SampledDebugFilter(debug_sample))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    if isinstance(levels, str):
+        levels = parse_levels(levels)
+    for name, module_level in levels.items():
+        logging.getLogger(name).setLevel(module_level)
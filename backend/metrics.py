@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import nullcontext
+
+
+METRICS_ENABLED = os.environ.get("CARLENS_METRICS", "1") != "0"
+# Where Chrome traces of jobs started with "trace": true are written
+TRACE_DIR = os.environ.get("CARLENS_TRACE_DIR", "traces")
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, Prometheus style."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Stage latency histograms and counters of this process, rendered in the
+    Prometheus text format. Gauges are read from callbacks at render time.
+    """
+
+    def __init__(self, prefix="carlens"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauges(self, name, callback):
+        """Export the numeric values of `callback()` (a dict) as gauges."""
+        self.gauges[name] = callback
+
+    def render(self):
+        lines = []
+        name = f"{self.prefix}_stage_seconds"
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            if histograms:
+                lines.append(f"# HELP {name} Time spent per pipeline stage.")
+                lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        declared = set()
+        for (counter, labels), value in counters:
+            metric = f"{self.prefix}_{counter}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+        for group, callback in sorted(self.gauges.items()):
+            for key, value in sorted(callback().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric = f"{self.prefix}_{group}_{key}"
+                    lines.append(f"# TYPE {metric} gauge")
+                    lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Worker processes keep their spans until the job returns them
+_worker_mode = False
+_pending = []
+
+
+def set_worker_mode():
+    """Called in pool workers: spans are shipped back with job results."""
+    global _worker_mode
+    _worker_mode = True
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, self.start, time.perf_counter() - self.start)
+        return False
+
+
+_NO_SPAN = nullcontext()
+
+
+def span(stage):
+    """Time a block as `stage`; a shared no-op when metrics are disabled."""
+    return _Span(stage) if METRICS_ENABLED else _NO_SPAN
+
+
+def record(stage, start, seconds):
+    if _worker_mode:
+        _pending.append((stage, start, seconds))
+    else:
+        registry.observe(stage, seconds)
+
+
+def drain():
+    """
+    Spans recorded in this worker since the last call.
+        Returns:
+            list(tuple): (stage, start, seconds); start is a perf_counter
+            value, which is system wide (CLOCK_MONOTONIC) on Linux
+    """
+    spans = _pending[:]
+    del _pending[:]
+    return spans
+
+
+class TraceRecorder:
+    """Spans of one job as Chrome trace events (chrome://tracing, Perfetto)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.events = []
+
+    def add(self, stage, start, seconds, pid=None, tid=0, **args):
+        event = {
+            "name": stage, "ph": "X",
+            "ts": round(start * 1e6, 1), "dur": round(seconds * 1e6, 1),
+            "pid": pid or os.getpid(), "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def save(self, trace_dir=TRACE_DIR):
+        os.makedirs(trace_dir, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_"
+                            for c in os.path.basename(self.name))
+        path = os.path.join(trace_dir, f"{safe_name}-{int(time.time())}.json")
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": "ms"}, trace_file)
+        return path
@@ -0,0 +1,212 @@
+import os
+import time
+import json
+import argparse
+import logging
+import joblib
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import LinearSVC
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neural_network import MLPClassifier
+
+
+BACKENDS = ("svm", "linear", "knn", "mlp")
+
+
+def best_estimator(model):
+    """The fitted estimator inside a search object, or the model itself."""
+    return getattr(model, "best_estimator_", model)
+
+
+def export_model(model, output_path):
+    """
+    Save only the inference model, uncompressed so ModelRegistry can
+    memory-map it. A search object is stripped of its CV results and of
+    every candidate but the best.
+        Returns:
+            int: size of the artifact in bytes
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    joblib.dump(best_estimator(model), output_path, compress=False)
+    size = os.path.getsize(output_path)
+    logging.info("Exported %s to %s (%d bytes)",
+                 type(best_estimator(model)).__name__, output_path, size)
+    return size
+
+
+class NumpyMLP:
+    """
+    Forward pass of a trained scaler + MLPClassifier pipeline in NumPy.
+    The scaler is folded into the first layer and the weights are float32,
+    so prediction is a few matrix products with no sklearn overhead.
+    """
+
+    def __init__(self, pipeline):
+        scaler, mlp = pipeline[0], pipeline[-1]
+        weights = [w.astype(np.float32) for w in mlp.coefs_]
+        biases = [b.astype(np.float32) for b in mlp.intercepts_]
+        # relu((x - mean) / scale @ W + b) == relu(x @ W' + b')
+        scale = scaler.scale_.astype(np.float32)
+        mean = scaler.mean_.astype(np.float32)
+        weights[0] = weights[0] / scale[:, None]
+        biases[0] = biases[0] - mean @ weights[0]
+        self.weights = weights
+        self.biases = biases
+        self.activation = mlp.activation
+        self.classes_ = mlp.classes_
+
+    def _hidden(self, z):
+        if self.activation == "relu":
+            return np.maximum(z, 0, out=z)
+        if self.activation == "tanh":
+            return np.tanh(z, out=z)
+        if self.activation == "logistic":
+            return 1.0 / (1.0 + np.exp(-z))
+        return z
+
+    def predict(self, X):
+        z = np.asarray(X, dtype=np.float32)
+        for w, b in zip(self.weights[:-1], self.biases[:-1]):
+            z = self._hidden(z @ w + b)
+        z = z @ self.weights[-1] + self.biases[-1]
+        # Softmax/logistic outputs are monotonic: compare the logits
+        if z.shape[1] == 1:
+            return self.classes_[(z[:, 0] > 0).astype(int)]
+        return self.classes_[z.argmax(axis=1)]
+
+
+def fit_backend(backend, X_train, y_train, svm_model=None):
+    """
+    Fit one inference backend on the training features.
+        Parameters:
+            backend (str): "svm" (the searched SVC, refit if not given),
+                "linear" (LinearSVC), "knn" (k-nearest neighbours, index
+                built at fit time) or "mlp" (small MLP run in NumPy)
+            svm_model: trained SVC or search to reuse for "svm"
+    """
+    if backend == "svm":
+        if svm_model is not None:
+            return best_estimator(svm_model)
+        from train_model import train
+        return best_estimator(train(X_train, y_train, search="halving",
+                                    probability=False))
+    if backend == "linear":
+        # The features outnumber the characters, so the dual problem is the
+        # smaller one; C=1.0 did not converge in 1000 iterations, a
+        # stronger regularization does in a fraction of the time
+        return make_pipeline(StandardScaler(), LinearSVC(
+            C=0.01, dual=True, max_iter=2000)).fit(X_train, y_train)
+    if backend == "knn":
+        return make_pipeline(StandardScaler(), KNeighborsClassifier(
+            n_neighbors=3, n_jobs=1)).fit(X_train, y_train)
+    if backend == "mlp":
+        pipeline = make_pipeline(StandardScaler(), MLPClassifier(
+            hidden_layer_sizes=(128,), early_stopping=True, max_iter=300,
+            random_state=42)).fit(X_train, y_train)
+        return NumpyMLP(pipeline)
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+
+def measure(model, X_test, y_test, repeats=5, batch_size=6):
+    """
+    Accuracy and prediction speed of a fitted model.
+        Parameters:
+            batch_size (int): characters per call for the latency figure,
+                one plate by default
+        Returns:
+            dict: accuracy, batch predictions/s and per-call latency
+    """
+    X_test = np.ascontiguousarray(X_test, dtype=np.float32)
+    accuracy = accuracy_score(y_test, model.predict(X_test))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(X_test)
+    batch_seconds = (time.perf_counter() - start) / repeats
+
+    calls = max(1, len(X_test) // batch_size)
+    start = time.perf_counter()
+    for i in range(calls):
+        model.predict(X_test[i * batch_size:(i + 1) * batch_size])
+    call_seconds = (time.perf_counter() - start) / calls
+
+    return {
+        "accuracy": round(float(accuracy), 4),
+        "predictions_per_s": round(len(X_test) / batch_seconds, 1),
+        "plate_latency_ms": round(1000 * call_seconds, 3),
+    }
+
+
+def benchmark_backends(X, y, backends=BACKENDS, svm_model=None,
+                       output_dir=None):
+    """
+    Fit every backend on the same split and compare them.
+        Parameters:
+            output_dir (str): if given, each backend is exported there and
+                its artifact size is reported
+        Returns:
+            dict: backend -> measurements
+    """
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42)
+    results = {}
+    for backend in backends:
+        start = time.perf_counter()
+        model = fit_backend(backend, X_train, y_train, svm_model)
+        results[backend] = {"fit_s": round(time.perf_counter() - start, 2),
+                            **measure(model, X_test, y_test)}
+        if output_dir is not None:
+            results[backend]["bytes"] = export_model(
+                model, os.path.join(output_dir, f"character_{backend}.pkl"))
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export a compact character model and compare backends.")
+    parser.add_argument("--model", default="models/character_recognition_svm.pkl",
+                        help="trained model or search to export")
+    parser.add_argument("--output", default="models/character_recognition.pkl",
+                        help="exported inference artifact")
+    parser.add_argument("--backend", choices=BACKENDS, default="svm",
+                        help="backend to export")
+    parser.add_argument("--data", default="data/characters",
+                        help="dataset, for the non-SVM backends and the benchmark")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare accuracy and speed of every backend")
+    parser.add_argument("--benchmark-dir", default=None,
+                        help="also export every benchmarked backend here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    svm_model = (joblib.load(args.model) if os.path.exists(args.model)
+                 else None)
+
+    if args.benchmark:
+        from train_model import load_data_from_folder
+        X, y = load_data_from_folder(args.data)
+        results = benchmark_backends(X, y, svm_model=svm_model,
+                                     output_dir=args.benchmark_dir)
+        print(json.dumps(results, indent=2))
+
+    if args.backend == "svm" and svm_model is not None:
+        model = best_estimator(svm_model)
+    else:
+        from train_model import load_data_from_folder
+        X, y = load_data_from_folder(args.data)
+        model = fit_backend(args.backend, X, y, svm_model)
+    size = export_model(model, args.output)
+    print(f"Model saved to {args.output} ({size} bytes)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Run from the module so NumpyMLP pickles as model_export.NumpyMLP
+    import model_export
+    model_export.main()
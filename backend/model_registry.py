@@ -0,0 +1,205 @@
+import os
+import time
+import logging
+import threading
+import resource
+import joblib
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.environ.get(
+    "CARLENS_MODEL_PATH", "./character_recognition_svm.pkl")
+# Seconds between two stat() calls on the artifact when hot reloading
+RELOAD_CHECK_INTERVAL = float(
+    os.environ.get("CARLENS_MODEL_RELOAD_INTERVAL", "2.0"))
+
+
+def current_rss_bytes():
+    """
+    Resident set size of the current process.
+        Returns:
+            int: RSS in bytes (peak RSS when /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def is_uncompressed_artifact(model_path):
+    """
+    Check whether a joblib artifact was dumped without compression.
+    Uncompressed pickles start with the PROTO opcode, compressed ones
+    start with the magic bytes of their compressor.
+        Parameters:
+            model_path (str): path of the joblib file
+        Returns:
+            bool: True if the file can be memory-mapped
+    """
+    with open(model_path, "rb") as artifact:
+        return artifact.read(1) == b"\x80"
+
+
+def export_mmap_artifact(model_path, output_path):
+    """
+    Re-dump a (compressed) model as an uncompressed joblib file so its
+    numpy arrays can be memory-mapped and shared between forked workers.
+        Parameters:
+            model_path (str): source joblib file
+            output_path (str): destination of the uncompressed artifact
+        Returns:
+            str: output_path
+    """
+    model = joblib.load(model_path)
+    joblib.dump(model, output_path, compress=False)
+    logger.info("Exported memory-mappable model to %s", output_path)
+    return output_path
+
+
+class ModelRegistry:
+    """
+    Keeps a single loaded instance of a joblib model per process.
+
+    The model is loaded lazily on the first `get` (or eagerly with `load`),
+    and reloaded when the file on disk changes. Uncompressed artifacts are
+    opened with mmap_mode="r" so that workers forked after loading share
+    the same physical pages.
+    """
+
+    def __init__(self, model_path, mmap_mode="auto",
+                 reload_interval=RELOAD_CHECK_INTERVAL):
+        self.model_path = model_path
+        self.mmap_mode = mmap_mode
+        self.reload_interval = reload_interval
+        self._model = None
+        self._signature = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            "path": model_path,
+            "loads": 0,
+            "load_seconds": None,
+            "rss_delta_bytes": None,
+            "file_size_bytes": None,
+            "memory_mapped": False,
+        }
+
+    def _file_signature(self):
+        stat = os.stat(self.model_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _resolve_mmap_mode(self):
+        if self.mmap_mode != "auto":
+            return self.mmap_mode
+        return "r" if is_uncompressed_artifact(self.model_path) else None
+
+    def load(self):
+        """
+        (Re)load the model from disk and record load time and memory use.
+            Returns:
+                the loaded estimator
+        """
+        with self._lock:
+            return self._load_locked()
+
+    def _load_locked(self):
+        signature = self._file_signature()
+        mmap_mode = self._resolve_mmap_mode()
+        rss_before = current_rss_bytes()
+        start = time.perf_counter()
+        model = joblib.load(self.model_path, mmap_mode=mmap_mode)
+        elapsed = time.perf_counter() - start
+
+        self._model = model
+        self._signature = signature
+        self._last_check = time.monotonic()
+        self._stats.update({
+            "loads": self._stats["loads"] + 1,
+            "load_seconds": elapsed,
+            "rss_delta_bytes": current_rss_bytes() - rss_before,
+            "file_size_bytes": signature[1],
+            "memory_mapped": mmap_mode is not None,
+        })
+        logger.info(
+            "Loaded model %s in %.3fs (rss +%.1f MiB, mmap=%s, pid=%d)",
+            self.model_path, elapsed,
+            self._stats["rss_delta_bytes"] / (1024 * 1024),
+            mmap_mode is not None, os.getpid())
+        return model
+
+    def _changed_on_disk(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return False
+        self._last_check = now
+        try:
+            return self._file_signature() != self._signature
+        except OSError:
+            # File is being replaced; keep serving the current model
+            return False
+
+    def get(self):
+        """
+        Return the loaded model, loading it or hot reloading it if needed.
+            Returns:
+                the loaded estimator
+        """
+        model = self._model
+        if model is not None and not self._changed_on_disk():
+            return model
+        with self._lock:
+            if self._model is None:
+                return self._load_locked()
+            try:
+                changed = self._file_signature() != self._signature
+            except OSError:
+                # Missing for a moment while it is replaced
+                return self._model
+            if not changed:
+                return self._model
+            logger.info("Model file %s changed, reloading", self.model_path)
+            try:
+                return self._load_locked()
+            except Exception as e:
+                # Half written: retried at the next check
+                logger.error("Could not reload model %s, keeping the "
+                             "current one: %s", self.model_path, e)
+                return self._model
+
+    def stats(self):
+        """Return a copy of the load statistics."""
+        return dict(self._stats)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(model_path=None):
+    """Return the process-wide registry for `model_path`."""
+    model_path = model_path or DEFAULT_MODEL_PATH
+    with _registries_lock:
+        registry = _registries.get(model_path)
+        if registry is None:
+            registry = _registries[model_path] = ModelRegistry(model_path)
+        return registry
+
+
+def get_model(model_path=None):
+    """Return the shared model instance for `model_path`."""
+    return get_registry(model_path).get()
+
+
+def warm_up(model_path=None):
+    """
+    Load the model eagerly, e.g. at server startup or in a pool worker
+    initializer, so the first frame does not pay the load cost.
+        Returns:
+            dict: load statistics
+    """
+    registry = get_registry(model_path)
+    registry.get()
+    return registry.stats()
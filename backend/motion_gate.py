@@ -0,0 +1,133 @@
+import os
+import cv2
+import numpy as np
+
+
+MOTION_GATE_ENABLED = os.environ.get("CARLENS_MOTION_GATE", "1") != "0"
+
+
+class MotionGate:
+    """
+    Cheap pre-stage deciding which frames (and which parts of them) need
+    the full plate detector.
+
+    Each frame is downscaled and compared against a running-average
+    background. Frames without enough changed pixels are skipped; for the
+    others the changed regions are returned so detection can be limited to
+    them. Every `refresh_interval` frames a full detection is forced so a
+    plate that stopped moving is still read.
+    """
+
+    def __init__(self, scale=0.25, diff_threshold=25, min_changed_fraction=0.002,
+                 learning_rate=0.05, roi_padding=24, max_roi_fraction=0.5,
+                 refresh_interval=30):
+        """
+            Parameters:
+                scale (float): downscale factor of the comparison image
+                diff_threshold (int): per-pixel difference counted as change
+                min_changed_fraction (float): changed pixels needed for motion
+                learning_rate (float): background update rate
+                roi_padding (int): pixels added around each changed region
+                max_roi_fraction (float): above this share of the frame the
+                    whole frame is analyzed instead of regions
+                refresh_interval (int): force a full detection every N frames
+        """
+        self.scale = scale
+        self.diff_threshold = diff_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.learning_rate = learning_rate
+        self.roi_padding = roi_padding
+        self.max_roi_fraction = max_roi_fraction
+        self.refresh_interval = refresh_interval
+        self.background = None
+        self._since_full = 0
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.pixels_seen = 0
+        self.pixels_skipped = 0
+
+    def _regions(self, mask, frame_shape):
+        """Padded, merged bounding boxes of the changed pixels, full scale."""
+        height, width = frame_shape[:2]
+        contours, _ = cv2.findContours(
+            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return []
+        # Merge overlapping padded boxes by drawing them and taking the
+        # connected components again
+        pad = max(1, int(round(self.roi_padding * self.scale)))
+        merged = np.zeros_like(mask)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            cv2.rectangle(merged, (x - pad, y - pad),
+                          (x + w + pad, y + h + pad), 255, cv2.FILLED)
+        contours, _ = cv2.findContours(
+            merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        regions = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            x0 = max(0, int(x / self.scale))
+            y0 = max(0, int(y / self.scale))
+            x1 = min(width, int(np.ceil((x + w) / self.scale)))
+            y1 = min(height, int(np.ceil((y + h) / self.scale)))
+            if x1 > x0 and y1 > y0:
+                regions.append((x0, y0, x1 - x0, y1 - y0))
+        return regions
+
+    def check(self, frame):
+        """
+        Compare a frame against the background.
+            Parameters:
+                frame (numpy.ndarray): BGR frame, cropped like process_frame
+            Returns:
+                tuple: (analyze, regions) where analyze is False for static
+                frames and regions is a list of (x, y, w, h) to analyze, or
+                None for the whole frame
+        """
+        self.frames_seen += 1
+        frame_pixels = frame.shape[0] * frame.shape[1]
+        self.pixels_seen += frame_pixels
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        if self.background is None:
+            self.background = small.astype(np.float32)
+            self._since_full = 0
+            return True, None
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        _, mask = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+        mask = cv2.dilate(mask, None, iterations=2)
+        cv2.accumulateWeighted(small, self.background, self.learning_rate)
+
+        self._since_full += 1
+        if self._since_full >= self.refresh_interval:
+            self._since_full = 0
+            return True, None
+
+        changed = cv2.countNonZero(mask)
+        if changed < self.min_changed_fraction * mask.size:
+            self.frames_skipped += 1
+            self.pixels_skipped += frame_pixels
+            return False, []
+
+        regions = self._regions(mask, frame.shape)
+        roi_pixels = sum(w * h for _, _, w, h in regions)
+        if roi_pixels > self.max_roi_fraction * frame_pixels:
+            return True, None
+        self.pixels_skipped += max(frame_pixels - roi_pixels, 0)
+        return True, regions
+
+    def stats(self):
+        return {
+            "frames_seen": self.frames_seen,
+            "frames_skipped": self.frames_skipped,
+            "pixels_seen": self.pixels_seen,
+            "pixels_skipped": self.pixels_skipped,
+            "pixel_skip_ratio": round(
+                self.pixels_skipped / self.pixels_seen, 4) if self.pixels_seen else 0.0,
+        }
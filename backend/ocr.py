@@ -1,20 +1,44 @@
+import logging
 import skimage.io as io
 from deskew_plate import deskew_img
 from segment_characters import segment_characters
 from finding_contour_plate import findContour
 from predict_characters import predict_characters
+from ocr_cache import get_ocr_cache
+from metrics import span
 
+logger = logging.getLogger(__name__)
 
-def OCR(img):
-    contours, ROI = findContour(img)
-    img = deskew_img(ROI, contour=contours)
-    try:
-        chrs, _ = segment_characters(img)
 
-        predictions = predict_characters(chrs)
+def extract_plate_characters(img):
+    """
+    Locate, deskew and segment the characters of a cropped plate.
+        Parameters:
+            img (numpy.ndarray): colored crop of a candidate plate
+        Returns:
+            list(numpy.ndarray): character images, left to right
+    """
+    with span("contour"):
+        contours, ROI = findContour(img)
+    with span("deskew"):
+        img = deskew_img(ROI, contour=contours)
+    try:
+        with span("segmentation"):
+            chrs, _ = segment_characters(img)
     except Exception as e:
-        print("Error in OCR", e)
-    return predictions
+        logger.debug("Error in OCR: %s", e)
+        return []
+    return chrs
+
+
+def OCR(img):
+    cache = get_ocr_cache()
+    key = cache.key(img)
+    prediction = cache.get(key)
+    if prediction is None:
+        prediction = predict_characters(extract_plate_characters(img))
+        cache.put(key, prediction)
+    return prediction
 
 
 # if __name__ == '__main__':
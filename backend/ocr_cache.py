@@ -0,0 +1,162 @@
+import os
+import time
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+
+OCR_CACHE_SIZE = int(os.environ.get("CARLENS_OCR_CACHE_SIZE", "512"))
+# Seconds a reading stays valid; 0 keeps it until evicted
+OCR_CACHE_TTL = float(os.environ.get("CARLENS_OCR_CACHE_TTL", "30"))
+# Most differing bits between the 64-bit hashes of two crops of one plate;
+# 1 px of jitter plus sensor noise flips up to about 10
+HASH_DISTANCE = int(os.environ.get("CARLENS_OCR_HASH_DISTANCE", "12"))
+# Size of the thumbnail a hash match is confirmed on, and how many pixels
+# it may be shifted by
+THUMBNAIL_SIZE = (160, 40)
+THUMBNAIL_SHIFT = 5
+# Least normalized correlation of the thumbnails of one plate; jittered
+# crops of a plate score above 0.98, plates one character apart below 0.96
+MATCH_SIMILARITY = float(os.environ.get("CARLENS_OCR_MATCH_SIMILARITY", "0.97"))
+
+
+def _gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+
+def plate_hash(img):
+    """
+    64-bit difference hash of a plate crop: sign of the horizontal
+    gradient of the grayscale crop shrunk to 9x8. Crops of the same plate
+    a pixel apart differ in a few bits, compared with the Hamming distance.
+        Returns:
+            int: the hash bits
+    """
+    small = cv2.resize(_gray(img), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def plate_thumbnail(img):
+    small = cv2.resize(_gray(img), THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    # Softened, so sub-pixel shifts between frames barely change it
+    return cv2.GaussianBlur(small, (0, 0), 1.0)
+
+
+def thumbnail_similarity(stored, thumbnail, shift=THUMBNAIL_SHIFT):
+    """Best normalized correlation of two thumbnails within +-shift px."""
+    return float(cv2.matchTemplate(
+        stored, thumbnail[shift:-shift, shift:-shift],
+        cv2.TM_CCOEFF_NORMED).max())
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PlateKey:
+    """Cache key of a crop: its hash and the thumbnail confirming a match."""
+    __slots__ = ("hash", "thumbnail")
+
+    def __init__(self, img):
+        self.hash = plate_hash(img)
+        self.thumbnail = plate_thumbnail(img)
+
+
+class OCRCache:
+    """
+    LRU cache of OCR readings of recent plate crops. Consecutive frames of
+    a plate give near identical crops: a crop whose hash is within
+    `distance` bits of a cached one, and whose thumbnail matches it,
+    returns the previous reading without segmentation, features or
+    prediction. The lookup is a linear scan, most recent entries first.
+    """
+
+    def __init__(self, max_size=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL,
+                 distance=HASH_DISTANCE, similarity=MATCH_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.distance = distance
+        self.similarity = similarity
+        # id -> (key, reading, stored_at), least recently used first
+        self.entries = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def key(self, img):
+        return PlateKey(img) if self.enabled and img.size else None
+
+    def _find(self, key):
+        now = time.monotonic()
+        expired = []
+        found = None
+        for entry_id in reversed(self.entries):
+            entry_key, _, stored_at = self.entries[entry_id]
+            if self.ttl and now - stored_at > self.ttl:
+                expired.append(entry_id)
+            elif (hamming(key.hash, entry_key.hash) <= self.distance
+                  and thumbnail_similarity(entry_key.thumbnail, key.thumbnail)
+                  >= self.similarity):
+                found = entry_id
+                break
+        for entry_id in expired:
+            del self.entries[entry_id]
+            self.expirations += 1
+        return found
+
+    def get(self, key):
+        """Cached reading of a crop matching `key`, or None."""
+        if key is None:
+            return None
+        entry_id = self._find(key)
+        if entry_id is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(entry_id)
+        self.hits += 1
+        return list(self.entries[entry_id][1])
+
+    def put(self, key, reading):
+        if key is None:
+            return
+        self.entries[self._next_id] = (key, tuple(reading), time.monotonic())
+        self._next_id += 1
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def counters(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# One cache per process: every worker keeps the readings of its own frames
+_cache = None
+
+
+def get_ocr_cache():
+    global _cache
+    if _cache is None:
+        _cache = OCRCache()
+    return _cache
@@ -0,0 +1,194 @@
+import os
+from plate_voter import VoteBook
+
+
+TRACKER_ENABLED = os.environ.get("CARLENS_TRACKER", "1") != "0"
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def box_center_distance(a, b):
+    """Distance between the centers of two boxes, in units of a's width."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2) - (bx + bw / 2)
+    dy = (ay + ah / 2) - (by + bh / 2)
+    return (dx * dx + dy * dy) ** 0.5 / max(aw, 1)
+
+
+def overlaps_any(box, boxes, threshold=0.3):
+    return any(box_iou(box, other) >= threshold for other in boxes)
+
+
+class Track:
+    """A plate followed across frames."""
+
+    def __init__(self, track_id, box, frame_count):
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame_count
+        self.last_frame = frame_count
+        self.hits = 1
+        self.misses = 0
+
+
+class PlateTracker:
+    """
+    IoU/centroid tracker over the (x, y, w, h) boxes found by process_frame.
+
+    Each plate gets a persistent track id and its readings are voted in
+    `votes` under that id. Once the vote of a track is confident its box is
+    no longer OCRed. Between two full detections (every `detect_interval`
+    frames) only the padded boxes of the live tracks are searched.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_center_distance=0.75,
+                 max_misses=15, detect_interval=10, search_padding=0.5,
+                 votes=None):
+        """
+            Parameters:
+                iou_threshold (float): minimum IoU to match a detection
+                max_center_distance (float): fallback match distance, in
+                    plate widths, for fast plates with no overlap
+                max_misses (int): frames without a match before a track ends
+                detect_interval (int): frames between full detections
+                search_padding (float): padding of tracked search regions,
+                    as a fraction of the box size
+                votes (VoteBook): where readings are voted, by track id
+        """
+        self.iou_threshold = iou_threshold
+        self.max_center_distance = max_center_distance
+        self.max_misses = max_misses
+        self.detect_interval = detect_interval
+        self.search_padding = search_padding
+        self.votes = votes if votes is not None else VoteBook()
+        self.tracks = {}
+        # Ended since the last pop_finished, so their votes can be reported
+        # and dropped instead of piling up over a long stream
+        self.finished = []
+        self._next_id = 1
+        self._last_full_detection = None
+        self.ocr_skipped = 0
+
+    def is_confident(self, track):
+        voter = self.votes.voters.get(track.track_id)
+        return voter is not None and voter.is_confident()
+
+    def plan(self, frame_count, frame_shape):
+        """
+        Decide how the next frame is analyzed.
+            Returns:
+                tuple: (regions, skip_boxes) where regions is None for a full
+                detection or the areas around the live tracks, and
+                skip_boxes are the boxes of confident tracks (no OCR)
+        """
+        skip_boxes = [track.box for track in self.tracks.values()
+                      if self.is_confident(track)]
+        if (not self.tracks or self._last_full_detection is None
+                or frame_count - self._last_full_detection >= self.detect_interval):
+            self._last_full_detection = frame_count
+            return None, skip_boxes
+
+        height, width = frame_shape[:2]
+        regions = []
+        for track in self.tracks.values():
+            x, y, w, h = track.box
+            pad_x = int(w * self.search_padding)
+            pad_y = int(h * self.search_padding)
+            x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+            x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+        return regions, skip_boxes
+
+    def _match(self, detections):
+        """Greedy association, best IoU first, then nearest center."""
+        pairs = []
+        for track_id, track in self.tracks.items():
+            for index, (box, _) in enumerate(detections):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((1.0 + iou, track_id, index))
+                else:
+                    distance = box_center_distance(track.box, box)
+                    if distance <= self.max_center_distance:
+                        pairs.append((1.0 - distance, track_id, index))
+        pairs.sort(reverse=True)
+
+        matches = {}
+        used = set()
+        for _, track_id, index in pairs:
+            if track_id in matches or index in used:
+                continue
+            matches[track_id] = index
+            used.add(index)
+        return matches, used
+
+    def update(self, frame_count, detections):
+        """
+        Associate the detections of a frame with the live tracks.
+            Parameters:
+                frame_count (int): index of the frame, in order
+                detections (list(tuple)): (box, text) pairs; text is None
+                    when the box was not OCRed or could not be read
+            Returns:
+                list(tuple): (track_id, voter) for every new reading
+        """
+        matches, used = self._match(detections)
+        readings = []
+
+        for track_id, index in matches.items():
+            track = self.tracks[track_id]
+            box, text = detections[index]
+            track.box = box
+            track.last_frame = frame_count
+            track.hits += 1
+            track.misses = 0
+            if text:
+                readings.append(self.votes.add(text, track.track_id))
+            elif self.is_confident(track):
+                self.ocr_skipped += 1
+
+        for index, (box, text) in enumerate(detections):
+            if index in used:
+                continue
+            track = Track(self._next_id, box, frame_count)
+            self._next_id += 1
+            self.tracks[track.track_id] = track
+            if text:
+                readings.append(self.votes.add(text, track.track_id))
+
+        for track_id in [track_id for track_id in self.tracks
+                         if track_id not in matches]:
+            track = self.tracks[track_id]
+            if track.last_frame == frame_count:
+                continue
+            track.misses += 1
+            if track.misses > self.max_misses:
+                self.finished.append(self.tracks.pop(track_id))
+        return readings
+
+    def pop_finished(self):
+        """
+        Tracks that ended since the last call; the tracker forgets them.
+            Returns:
+                list(Track): ended tracks, oldest first
+        """
+        finished, self.finished = self.finished, []
+        return finished
+
+    def stats(self):
+        return {
+            "tracks": self._next_id - 1,
+            "live_tracks": len(self.tracks),
+            "ocr_skipped": self.ocr_skipped,
+        }
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+
+
+PLATE_LENGTH = 6
+DIGITS = "123456789"
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnoprstuvwxyz"
+ALPHABET = DIGITS + LETTERS
+ALPHABET_INDEX = {ch: i for i, ch in enumerate(ALPHABET)}
+
+# Characters allowed at each position: a digit, three letters, two digits
+VALID_AT_POSITION = np.zeros((PLATE_LENGTH, len(ALPHABET)), dtype=bool)
+VALID_AT_POSITION[[0, 4, 5], :len(DIGITS)] = True
+VALID_AT_POSITION[1:4, len(DIGITS):] = True
+
+# Readings and per-position agreement needed before a plate is emitted
+MIN_READINGS = int(os.environ.get("CARLENS_VOTE_MIN_READINGS", "3"))
+MIN_AGREEMENT = float(os.environ.get("CARLENS_VOTE_MIN_AGREEMENT", "0.6"))
+
+
+class PlateVoter:
+    """
+    Incremental vote over the readings of one plate hypothesis.
+    Keeps a count per (position, character), so adding a reading and
+    querying the current best string cost a constant amount of work.
+    """
+
+    def __init__(self, min_readings=MIN_READINGS, min_agreement=MIN_AGREEMENT):
+        self.min_readings = min_readings
+        self.min_agreement = min_agreement
+        self.counts = np.zeros((PLATE_LENGTH, len(ALPHABET)), dtype=np.int32)
+        self.readings = 0
+        self.emitted = False
+
+    def add(self, text):
+        """Count a reading; characters invalid at their position are ignored."""
+        for position, ch in enumerate(text[:PLATE_LENGTH]):
+            index = ALPHABET_INDEX.get(ch)
+            if index is not None and VALID_AT_POSITION[position, index]:
+                self.counts[position, index] += 1
+        self.readings += 1
+
+    def best(self):
+        """Most voted character per position ('' where nothing is valid)."""
+        best = self.counts.argmax(axis=1)
+        voted = self.counts[np.arange(PLATE_LENGTH), best]
+        return "".join(ALPHABET[index] if votes else ""
+                       for index, votes in zip(best, voted))
+
+    def confidence(self):
+        """Lowest share of the winning character over all positions."""
+        totals = self.counts.sum(axis=1)
+        if not totals.all():
+            return 0.0
+        return float((self.counts.max(axis=1) / totals).min())
+
+    def is_confident(self):
+        return (self.readings >= self.min_readings
+                and self.confidence() >= self.min_agreement)
+
+
+def hamming_distance(a, b):
+    return sum(x != y for x, y in zip(a, b)) + abs(len(a) - len(b))
+
+
+class VoteBook:
+    """
+    Plate hypotheses of a video. Readings are grouped by an explicit key
+    (a track id) or, without one, with the hypothesis whose current best
+    string is within `max_distance` characters.
+    """
+
+    def __init__(self, max_distance=2, min_readings=MIN_READINGS,
+                 min_agreement=MIN_AGREEMENT):
+        self.max_distance = max_distance
+        self.min_readings = min_readings
+        self.min_agreement = min_agreement
+        self.voters = {}
+        self._next_key = 1
+        self._any_emitted = False
+        # Best supported hypothesis finished without being emitted, kept
+        # for the fallback of `pending`
+        self._fallback = None
+
+    def _nearest(self, text):
+        best_key, best_distance = None, self.max_distance + 1
+        for key, voter in self.voters.items():
+            distance = hamming_distance(voter.best(), text)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def add(self, text, key=None):
+        """
+        Add a reading.
+            Returns:
+                tuple: (key, voter) of the hypothesis it was counted in
+        """
+        if key is None:
+            key = self._nearest(text)
+            if key is None:
+                key = f"plate-{self._next_key}"
+                self._next_key += 1
+        voter = self.voters.get(key)
+        if voter is None:
+            voter = self.voters[key] = PlateVoter(
+                self.min_readings, self.min_agreement)
+        voter.add(text)
+        return key, voter
+
+    def ready(self, voter):
+        """True once for a voter that just became confident."""
+        if voter.emitted or not voter.is_confident():
+            return False
+        voter.emitted = True
+        self._any_emitted = True
+        return True
+
+    def finish(self, key, min_readings=1):
+        """
+        Drop a hypothesis that will get no more readings (its track ended).
+            Returns:
+                PlateVoter: the voter, marked as emitted, if it was never
+                emitted and has at least `min_readings` readings; else None
+        """
+        voter = self.voters.pop(key, None)
+        if voter is None or voter.emitted:
+            return None
+        if voter.readings >= min_readings:
+            voter.emitted = True
+            self._any_emitted = True
+            return voter
+        if (self._fallback is None
+                or voter.readings > self._fallback[1].readings):
+            self._fallback = (key, voter)
+        return None
+
+    def pending(self, min_readings=1):
+        """
+        Hypotheses never emitted with at least `min_readings` readings,
+        marked as emitted; used at the end of a video. If nothing was ever
+        emitted, the best supported hypothesis is returned regardless.
+        """
+        remaining = [(key, voter) for key, voter in self.voters.items()
+                     if not voter.emitted and voter.readings >= min_readings]
+        if not remaining and not self._any_emitted:
+            candidates = list(self.voters.items())
+            if self._fallback is not None:
+                candidates.append(self._fallback)
+            if candidates:
+                remaining = [max(candidates,
+                                 key=lambda item: item[1].readings)]
+        for _, voter in remaining:
+            voter.emitted = True
+        self._any_emitted = self._any_emitted or bool(remaining)
+        return remaining
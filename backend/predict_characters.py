@@ -1,17 +1,53 @@
 import cv2
-import os
 import numpy as np
-import logging
-import joblib
-from extract_features import extract_combined_features
+from extract_features import (
+    extract_combined_features_batch, CHAR_HEIGHT, CHAR_WIDTH)
+from model_registry import get_model
+from metrics import span
+
+
+def characters_to_features(characters):
+    """
+    Build one contiguous feature matrix for a list of character images.
+        Parameters:
+            characters (list(numpy.ndarray)): binary character images
+        Returns:
+            numpy.ndarray: (N, D) float32 feature matrix
+    """
+    stack = np.empty((len(characters), CHAR_HEIGHT, CHAR_WIDTH), dtype=np.uint8)
+    for i, ch in enumerate(characters):
+        stack[i] = cv2.resize(ch, (CHAR_WIDTH, CHAR_HEIGHT))
+    return extract_combined_features_batch(stack)
+
+
+def classify_character_groups(character_groups):
+    """
+    Classify the characters of many plates with a single predict call.
+    The characters of every group are stacked into one feature matrix,
+    classified together and scattered back to their group.
+        Parameters:
+            character_groups (list(list(numpy.ndarray))): characters per plate
+        Returns:
+            list(numpy.ndarray): predictions per plate, in input order
+    """
+    sizes = [len(group) for group in character_groups]
+    all_characters = [ch for group in character_groups for ch in group]
+    if not all_characters:
+        return [np.array([]) for _ in character_groups]
+
+    model = get_model()
+    with span("features"):
+        features = characters_to_features(all_characters)
+    with span("classification"):
+        predictions = model.predict(features)
+
+    results = []
+    start = 0
+    for size in sizes:
+        results.append(predictions[start:start + size])
+        start += size
+    return results
 
 
 def predict_characters(characters):
-    print("Current working directory:", os.getcwd())
-    model = joblib.load("./character_recognition_svm.pkl")
-    character_features = []
-    for ch in characters:
-        ch = cv2.resize(ch, (28, 42))
-        character_features.append(extract_combined_features(ch))
-    predictions = model.predict(character_features)
-    return predictions
+    return classify_character_groups([characters])[0]
@@ -2,6 +2,8 @@ import cv2
 import numpy as np
 import logging
 
+logger = logging.getLogger(__name__)
+
 
 def preprocess_license_plate(image):
     """
@@ -14,23 +16,22 @@ def preprocess_license_plate(image):
     Returns:
         binary image
     """
-    logging.info("Resize the image for consistency")
+    # Resize the image for consistency
     resized_img = cv2.resize(image, (333, 75))
 
-    logging.info("Convert to grayscale")
+    # Convert to grayscale
     gray_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2GRAY)
 
-    logging.info("Apply binary thresholding")
+    # Apply binary thresholding
     _, binary_img = cv2.threshold(
         gray_img, 200, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 
-    logging.info("Morphological operations to reduce noise")
+    # Morphological operations to reduce noise
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
     binary_img = cv2.erode(binary_img, kernel, iterations=1)
     binary_img = cv2.dilate(binary_img, kernel, iterations=1)
 
-    logging.info(
-        "Make borders white to avoid detecting contours near the edges")
+    # Make borders white to avoid detecting contours near the edges
     binary_img[:3, :] = 255
     binary_img[-3:, :] = 255
     binary_img[:, :3] = 255
@@ -48,7 +49,7 @@ def extract_character_contours(binary_img, numChars=6):
             character_contours (list(numpy.ndarray)): sorted array of characyer contours from left to right
 
     """
-    logging.info("Define estimated dimensions for character contours")
+    # Define estimated dimensions for character contours
     height, width = binary_img.shape
     dimensions = {
         "min_height": height / 3,
@@ -57,16 +58,16 @@ def extract_character_contours(binary_img, numChars=6):
         "max_width": width / 3
     }
 
-    logging.info("Find contours in the binary image")
+    # Find contours in the binary image
     contours, _ = cv2.findContours(
         binary_img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-    print(dimensions)
+    logger.debug("Character size limits: %s", dimensions)
     character_contours = []
-    logging.info("Filter contours based on size")
-    logging.info("Sort contours by x-coordinate to ensure left-to-right order")
+    # Filter contours based on size
+    # Sort contours by x-coordinate to ensure left-to-right order
     for contour in contours:
         x, y, w, h = cv2.boundingRect(contour)
-        print(x, y, w, h)
+        logger.debug("Contour box x=%d y=%d w=%d h=%d", x, y, w, h)
         if dimensions["min_width"] < w < dimensions["max_width"] and dimensions["min_height"] < h < dimensions["max_height"]:
             character_contours.append((x, y, w, h))
 
@@ -103,13 +104,13 @@ def segment_characters(image):
                 charaters (list(numpy.ndarray)): list of character images
                 character_contours (list(numpy.ndarray)): list of sorted character contours
     """
-    logging.info("Preprocess the image")
+    # Preprocess the image
     binary_img = preprocess_license_plate(image)
 
-    logging.info("Extract character contours")
+    # Extract character contours
     character_contours = extract_character_contours(binary_img)
 
-    logging.info("Crop and resize individual characters")
+    # Crop and resize individual characters
     characters = []
     for (x, y, w, h) in character_contours:
         char_img = binary_img[y:y + h, x:x + w]
@@ -0,0 +1,287 @@
+import os
+import time
+import shutil
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from upload_store import PARTIAL_FOLDER
+
+
+# Videos processed at the same time, and waiting for a turn, server-wide
+MAX_RUNNING_JOBS = int(os.environ.get("CARLENS_MAX_JOBS", "4"))
+MAX_QUEUED_JOBS = int(os.environ.get("CARLENS_MAX_QUEUED_JOBS", "8"))
+# Disconnected sessions, and partial uploads nobody writes to, are kept
+# this long so the uploads can resume
+SESSION_TTL = float(os.environ.get("CARLENS_SESSION_TTL", "3600"))
+
+
+class WaitStats:
+    """Count and total/maximum wait time of granted requests."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+
+    def summary(self):
+        return {
+            "granted": self.count,
+            "mean_wait_ms": round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            "max_wait_ms": round(1000 * self.longest, 3),
+        }
+
+
+class FairScheduler:
+    """
+    Shares the worker pool between sessions.
+
+    A frame needs one of `capacity` slots before it is submitted to the
+    pool. When slots are short, waiting sessions are served round robin,
+    one frame each, so a long video cannot starve a short one.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiters = OrderedDict()
+        self.wait_stats = WaitStats()
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.waiters.values())
+
+    async def acquire(self, session_id):
+        if self.in_use < self.capacity and not self.waiters:
+            self.in_use += 1
+            self.wait_stats.add(0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(session_id, deque()).append(
+            (future, time.monotonic()))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation: give it back
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._grant()
+
+    def _grant(self):
+        while self.in_use < self.capacity and self.waiters:
+            session_id, queue = next(iter(self.waiters.items()))
+            future, queued_at = queue.popleft()
+            # Next grant goes to the next session in line
+            if queue:
+                self.waiters.move_to_end(session_id)
+            else:
+                del self.waiters[session_id]
+            if future.done():
+                continue
+            self.in_use += 1
+            self.wait_stats.add(time.monotonic() - queued_at)
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queue_depth": self.queue_depth(),
+            "sessions_waiting": len(self.waiters),
+            **self.wait_stats.summary(),
+        }
+
+
+class JobRejected(Exception):
+    """Raised when the server is saturated and the job queue is full."""
+
+
+class JobAdmission:
+    """
+    Admission control for video jobs: at most `max_running` run at once,
+    up to `max_queued` wait in FIFO order, the others are rejected.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        self.queue = deque()
+        self.rejected = 0
+        self.wait_stats = WaitStats()
+
+    @asynccontextmanager
+    async def admit(self, on_queued=None):
+        """
+        Hold a job slot for the duration of the block.
+            Parameters:
+                on_queued (coroutine function): called with the queue
+                    position when the job has to wait
+            Raises:
+                JobRejected: if the queue is full
+        """
+        start = time.monotonic()
+        if self.running >= self.max_running or self.queue:
+            if len(self.queue) >= self.max_queued:
+                self.rejected += 1
+                raise JobRejected(
+                    f"{self.running} jobs running and {len(self.queue)} queued")
+            future = asyncio.get_running_loop().create_future()
+            self.queue.append(future)
+            try:
+                if on_queued is not None:
+                    await on_queued(len(self.queue))
+                await future
+            except BaseException:
+                # Cancelled, or the queue notification failed
+                if future.done() and not future.cancelled():
+                    # Granted meanwhile: give the slot back
+                    self._finish()
+                else:
+                    self.queue.remove(future)
+                raise
+        else:
+            self.running += 1
+        self.wait_stats.add(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.running -= 1
+        while self.queue and self.running < self.max_running:
+            future = self.queue.popleft()
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+
+    def stats(self):
+        return {
+            "max_running": self.max_running,
+            "running": self.running,
+            "queued": len(self.queue),
+            "max_queued": self.max_queued,
+            "rejected": self.rejected,
+            **self.wait_stats.summary(),
+        }
+
+
+class Session:
+    """State of one client: its uploads, its sender and its jobs."""
+
+    def __init__(self, session_id, upload_root):
+        self.session_id = session_id
+        self.upload_folder = os.path.join(upload_root, session_id)
+        os.makedirs(self.upload_folder, exist_ok=True)
+        # Shared by every session: an upload resumes by its id alone, a
+        # random token only the client that started the upload was given
+        self.partial_folder = os.path.join(upload_root, PARTIAL_FOLDER)
+        self.uploads = {}
+        self.tasks = set()
+        # Job processing each upload, by upload id
+        self.upload_jobs = {}
+        self.connected = False
+        self.last_seen = time.monotonic()
+
+    def start_job(self, coroutine, upload_id=None):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if upload_id is not None:
+            self.upload_jobs[upload_id] = task
+            task.add_done_callback(
+                lambda _: self.upload_jobs.pop(upload_id, None))
+        return task
+
+    def has_upload_job(self, upload_id):
+        """Whether a job is already processing this upload."""
+        task = self.upload_jobs.get(upload_id)
+        return task is not None and not task.done()
+
+    def cancel_jobs(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def close_uploads(self):
+        # Partial files and their ranges stay on disk for a resume
+        for upload in self.uploads.values():
+            upload.close()
+
+
+class SessionRegistry:
+    """Sessions by id, so a reconnecting client finds its uploads again."""
+
+    def __init__(self, upload_root, ttl=SESSION_TTL):
+        self.upload_root = upload_root
+        self.ttl = ttl
+        self.sessions = {}
+
+    def attach(self, session_id=None):
+        """Return the session `session_id`, or a new one."""
+        self.prune()
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session_id = uuid.uuid4().hex
+            session = self.sessions[session_id] = Session(
+                session_id, self.upload_root)
+            logging.info("New session %s", session_id)
+        session.connected = True
+        session.last_seen = time.monotonic()
+        return session
+
+    def detach(self, session):
+        session.connected = False
+        session.last_seen = time.monotonic()
+        session.close_uploads()
+
+    def prune(self):
+        """
+        Forget sessions disconnected for longer than the TTL and delete
+        their files, then the partial uploads untouched for as long.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if not session.connected and now - session.last_seen > self.ttl:
+                del self.sessions[session_id]
+                session.close_uploads()
+                shutil.rmtree(session.upload_folder, ignore_errors=True)
+                logging.info("Session %s expired", session_id)
+        self.prune_partial_uploads()
+
+    def prune_partial_uploads(self):
+        partial_folder = os.path.join(self.upload_root, PARTIAL_FOLDER)
+        open_paths = {upload.part_path for session in self.sessions.values()
+                      for upload in session.uploads.values()
+                      if upload.fd is not None}
+        try:
+            names = os.listdir(partial_folder)
+        except OSError:
+            return
+        # Partial files are written to and stat'ed with wall clock times
+        now = time.time()
+        for name in names:
+            path = os.path.join(partial_folder, name)
+            part_path = path[:-len(".json")] if name.endswith(".json") else path
+            try:
+                if (part_path not in open_paths
+                        and now - os.path.getmtime(path) > self.ttl):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "connected": sum(s.connected for s in self.sessions.values()),
+            "jobs": sum(len(s.tasks) for s in self.sessions.values()),
+        }
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(BACKEND)
+# The backend modules import each other by their plain names
+sys.path.insert(0, BACKEND)
+
+
+@pytest.fixture
+def dataset_frame():
+    """dataset/02.png, with the plate the contour search finds in it."""
+    import cv2
+    from wrapper import FRAME_TOP_CROP
+    frame = cv2.imread(os.path.join(REPO_ROOT, "dataset", "02.png"))
+    if frame is None:
+        pytest.skip("dataset/02.png is not available")
+    return frame[FRAME_TOP_CROP:, :], (14, 192, 164, 71)
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+fastapi_testclient = pytest.importorskip("fastapi.testclient")
+
+import app
+from sessions import JobAdmission, SessionRegistry
+from frame_source import LIVE_QUEUE_SIZE
+from upload_store import BINARY_HEADER, KIND_FRAME, KIND_UPLOAD_CHUNK
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "sessions", SessionRegistry(str(tmp_path)))
+    # Every job is rejected
+    monkeypatch.setattr(app, "admission",
+                        JobAdmission(max_running=0, max_queued=0))
+    with fastapi_testclient.TestClient(app.app) as client:
+        yield client
+
+
+def test_frames_of_a_rejected_stream_do_not_block(client):
+    with client.websocket_connect("/ws") as ws:
+        assert ws.receive_json()["type"] == "SESSION"
+        ws.send_text(json.dumps({"type": "STREAM_START"}))
+        assert ws.receive_json()["type"] == "JOB_REJECTED"
+        # More frames than the live queue holds
+        for frame_count in range(2 * LIVE_QUEUE_SIZE):
+            ws.send_bytes(BINARY_HEADER.pack(KIND_FRAME, frame_count) + b"jpeg")
+        ws.send_text(json.dumps({"type": "STREAM_END"}))
+        ws.send_text(json.dumps({"type": "UPLOAD_START",
+                                 "filename": "video.mp4", "size": 10}))
+        assert ws.receive_json()["type"] == "UPLOAD_READY"
+
+
+def test_malformed_chunks_keep_the_connection(client):
+    with client.websocket_connect("/ws") as ws:
+        assert ws.receive_json()["type"] == "SESSION"
+        ws.send_text(json.dumps({"type": "UPLOAD_START",
+                                 "filename": "video.mp4", "size": 10}))
+        assert ws.receive_json()["type"] == "UPLOAD_READY"
+        # Shorter than the header, then a chunk past the end of the file
+        ws.send_bytes(b"\x00\x01")
+        ws.send_bytes(BINARY_HEADER.pack(KIND_UPLOAD_CHUNK, 8) + b"12345")
+        ws.send_bytes(BINARY_HEADER.pack(KIND_UPLOAD_CHUNK, 0) + b"12345")
+        assert ws.receive_json() == {"type": "RECEIVED_CHUNK", "offset": 0}
+        ws.send_text(json.dumps({"type": "UPLOAD_COMPLETED"}))
+        assert ws.receive_json()["missing"] == [[5, 10]]
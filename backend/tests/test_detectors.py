@@ -0,0 +1,26 @@
+import pytest
+
+from benchmark import synthetic_video, detection_recall
+from edge_density import find_dense_windows
+from wrapper import detect_plate_candidates, FRAME_TOP_CROP
+
+
+def test_edge_density_finds_synthetic_plates():
+    video, truth = synthetic_video(10, return_boxes=True)
+    recalls = [detection_recall(boxes, find_dense_windows(frame[FRAME_TOP_CROP:]))
+               for frame, boxes in zip(video, truth)]
+    assert min(recalls) == 1.0
+
+
+def test_edge_density_finds_dataset_plate(dataset_frame):
+    frame, plate = dataset_frame
+    assert detection_recall([plate], find_dense_windows(frame)) == 1.0
+
+
+@pytest.mark.parametrize("scales", [(0.9,), (0.75,), (0.5,), (0.5, 0.25)])
+def test_downscaled_detection_agrees_with_full_resolution(dataset_frame, scales):
+    frame, plate = dataset_frame
+    full = detect_plate_candidates(frame, None, (1.0,))
+    assert plate in full
+    coarse = detect_plate_candidates(frame, None, scales)
+    assert detection_recall(full, coarse) == 1.0
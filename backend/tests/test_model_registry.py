@@ -0,0 +1,23 @@
+import os
+
+import joblib
+
+from model_registry import ModelRegistry
+
+
+def test_keeps_the_model_while_its_file_is_replaced(tmp_path):
+    path = str(tmp_path / "model.pkl")
+    joblib.dump({"version": 1}, path)
+    registry = ModelRegistry(path, reload_interval=0)
+    assert registry.get() == {"version": 1}
+
+    os.remove(path)
+    assert registry.get() == {"version": 1}
+
+    # Half written
+    with open(path, "wb") as artifact:
+        artifact.write(b"\x80")
+    assert registry.get() == {"version": 1}
+
+    joblib.dump({"version": 2, "classes": "0123456789"}, path)
+    assert registry.get()["version"] == 2
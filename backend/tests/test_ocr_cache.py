@@ -0,0 +1,51 @@
+import numpy as np
+
+from benchmark import render_plate
+from ocr_cache import OCRCache
+
+
+def jittered(frame, box, dx, dy, seed=0):
+    x, y, w, h = box
+    crop = frame[y + dy:y + dy + h, x + dx:x + dx + w].astype(np.int16)
+    noise = np.random.default_rng(seed).integers(-3, 4, crop.shape)
+    return np.clip(crop + noise, 0, 255).astype(np.uint8)
+
+
+def test_jittered_noisy_crop_hits(dataset_frame):
+    frame, plate = dataset_frame
+    cache = OCRCache()
+    cache.put(cache.key(jittered(frame, plate, 0, 0)), ["A", "B"])
+    for seed, (dx, dy) in enumerate([(1, 0), (0, 1), (-1, -1), (1, -1)]):
+        crop = jittered(frame, plate, dx, dy, seed + 1)
+        assert cache.get(cache.key(crop)) == ["A", "B"]
+    assert cache.stats()["hit_rate"] == 1.0
+
+
+def test_plate_one_character_apart_misses():
+    cache = OCRCache()
+    cache.put(cache.key(render_plate("1ABC23")), list("1ABC23"))
+    assert cache.get(cache.key(render_plate("1ABD23"))) is None
+    assert cache.get(cache.key(render_plate("1ABC23"))) == list("1ABC23")
+
+
+def test_expired_entries_are_dropped():
+    cache = OCRCache(ttl=1e-9)
+    key = cache.key(render_plate("1ABC23"))
+    cache.put(key, list("1ABC23"))
+    assert cache.get(key) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_failed_classification_is_not_cached(dataset_frame, monkeypatch):
+    import wrapper
+
+    def unavailable_model(character_groups):
+        raise OSError("no model")
+
+    frame, plate = dataset_frame
+    cache = OCRCache()
+    monkeypatch.setattr(wrapper, "get_ocr_cache", lambda: cache)
+    monkeypatch.setattr(wrapper, "classify_character_groups", unavailable_model)
+    # The candidate is left unread, the frame can still be annotated
+    assert wrapper.read_candidates(frame, [plate]) == [[]]
+    assert cache.stats()["size"] == 0
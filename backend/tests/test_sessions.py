@@ -0,0 +1,82 @@
+import os
+import time
+import asyncio
+
+import pytest
+
+from sessions import JobAdmission, SessionRegistry
+from upload_store import open_upload, finish_upload
+
+
+def test_failed_queue_notification_frees_the_queue():
+    async def scenario():
+        admission = JobAdmission(max_running=1, max_queued=1)
+        release = asyncio.Event()
+
+        async def running_job():
+            async with admission.admit():
+                await release.wait()
+
+        async def failing_notification(position):
+            raise ConnectionError("client gone")
+
+        running = asyncio.create_task(running_job())
+        await asyncio.sleep(0)
+        with pytest.raises(ConnectionError):
+            async with admission.admit(failing_notification):
+                pass
+        assert admission.stats()["queued"] == 0
+
+        release.set()
+        await running
+        assert admission.stats()["running"] == 0
+        # The slot is free again for the next job
+        async with admission.admit():
+            assert admission.stats()["running"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_prune_deletes_expired_session_files(tmp_path):
+    registry = SessionRegistry(str(tmp_path), ttl=0)
+    session = registry.attach()
+    upload = open_upload(session.uploads, session.upload_folder, "video.mp4",
+                         10, session.partial_folder)
+    upload.write(0, b"12345")
+    registry.detach(session)
+    time.sleep(0.01)
+    registry.prune()
+    assert session.session_id not in registry.sessions
+    assert not os.path.exists(session.upload_folder)
+    assert not os.listdir(session.partial_folder)
+
+
+def test_upload_resumes_only_with_its_id(tmp_path):
+    first = SessionRegistry(str(tmp_path)).attach()
+    upload = open_upload(first.uploads, first.upload_folder, "video.mp4", 10,
+                         first.partial_folder)
+    upload.write(0, b"12345")
+    upload.close()
+
+    # A restarted server knows nothing of the first session
+    second = SessionRegistry(str(tmp_path)).attach()
+    resumed = open_upload(second.uploads, second.upload_folder, "video.mp4",
+                          10, second.partial_folder, upload.upload_id)
+    assert resumed.upload_id == upload.upload_id
+    assert resumed.missing() == [(5, 10)]
+
+    # Another client with a file of the same name and size, or a made up
+    # id, gets an upload of its own
+    other = SessionRegistry(str(tmp_path)).attach()
+    for upload_id in (None, "0" * 32):
+        fresh = open_upload(other.uploads, other.upload_folder, "video.mp4",
+                            10, other.partial_folder, upload_id)
+        assert fresh.upload_id not in (upload.upload_id, upload_id)
+        assert fresh.missing() == [(0, 10)]
+    fresh.write(0, b"abcdefghij")
+
+    resumed.write(5, b"67890")
+    with open(finish_upload(second.uploads, resumed), "rb") as video:
+        assert video.read() == b"1234567890"
+    with open(finish_upload(other.uploads, fresh), "rb") as video:
+        assert video.read() == b"abcdefghij"
@@ -1,73 +1,228 @@
 import os
-import cv2
-import joblib
-from sklearn.model_selection import train_test_split
+import time
+import argparse
+from scipy.stats import loguniform
 from sklearn.metrics import classification_report, accuracy_score
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report, accuracy_score
 from sklearn import svm
-from sklearn.model_selection import GridSearchCV
-from extract_features import extract_combined_features
+from sklearn.pipeline import Pipeline
+from sklearn.decomposition import PCA
+from sklearn.feature_selection import SelectKBest, f_classif
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV
+from feature_store import FeatureStore
+from model_export import export_model, measure
 import numpy as np
 
 
-def load_data_from_folder(folder_path, image_size=(28, 42)):
+PARAM_GRID = {'C': [0.1, 1, 10, 100],
+              'gamma': [0.0001, 0.001, 0.1, 1],
+              'kernel': ['rbf', 'poly', 'linear']}
+PARAM_DISTRIBUTIONS = {'C': loguniform(1e-2, 1e3),
+                       'gamma': loguniform(1e-5, 1),
+                       'kernel': ['rbf', 'poly', 'linear']}
+SEARCHES = ("grid", "halving", "random")
+REDUCTIONS = ("none", "pca", "kbest")
+
+
+def load_data_from_folder(folder_path, image_size=(28, 42), workers=None):
     """
-    Load data and labels from a folder structure.
+    Load data and labels from a folder structure. Features come from the
+    feature store next to the folder, which only extracts images that are
+    new or changed since the last run.
     Args:
         folder_path: Root folder containing subfolders for each class.
         image_size: Tuple (width, height) to resize images.
+        workers: Processes extracting new features (default: all cores).
     Returns:
-        X: List of feature vectors.
-        y: List of labels.
+        X: (N, D) float32 feature matrix, memory-mapped.
+        y: Array of labels.
+    """
+    return FeatureStore(folder_path, image_size=image_size).load(workers)
+
+
+def make_estimator(reduce="none", components=128):
+    """
+    The SVC, behind an optional dimensionality reduction stage.
+        Parameters:
+            reduce (str): "pca" projects the features on their first
+                `components` principal axes, "kbest" keeps the
+                `components` features with the best ANOVA F-score
+        Returns:
+            tuple: (estimator, prefix of the SVC parameters)
+    """
+    # No Platt scaling during the search: it runs an extra internal CV on
+    # every fit and does not change the predicted classes
+    svc = svm.SVC(probability=False)
+    if reduce == "pca":
+        reducer = PCA(n_components=components, svd_solver="randomized",
+                      random_state=42)
+    elif reduce == "kbest":
+        reducer = SelectKBest(f_classif, k=components)
+    elif reduce in (None, "none"):
+        return svc, ""
+    else:
+        raise ValueError(
+            f"Unknown reduction {reduce!r}, expected one of {REDUCTIONS}")
+    # Saved with the model, so inference reduces the whole batch in one call
+    return Pipeline([("reduce", reducer), ("svc", svc)]), "svc__"
+
+
+def make_search(search="grid", n_jobs=-1, cv=5, n_iter=20, random_state=42,
+                reduce="none", components=128):
+    """
+    Build the hyperparameter search over the SVC.
+        Parameters:
+            search (str): "grid" tries every combination, "halving" runs a
+                successive-halving grid that drops the worst candidates on
+                small samples first, "random" samples `n_iter` candidates
+            n_jobs (int): parallel fits, -1 for every core
+            reduce, components: see make_estimator
+    """
+    estimator, prefix = make_estimator(reduce, components)
+    grid = {prefix + name: values for name, values in PARAM_GRID.items()}
+    distributions = {prefix + name: values
+                     for name, values in PARAM_DISTRIBUTIONS.items()}
+    if search == "grid":
+        return GridSearchCV(estimator, grid, cv=cv, n_jobs=n_jobs)
+    if search == "halving":
+        return HalvingGridSearchCV(estimator, grid, cv=cv, n_jobs=n_jobs,
+                                   factor=3, random_state=random_state)
+    if search == "random":
+        return RandomizedSearchCV(estimator, distributions, n_iter=n_iter,
+                                  cv=cv, n_jobs=n_jobs,
+                                  random_state=random_state)
+    raise ValueError(f"Unknown search {search!r}, expected one of {SEARCHES}")
+
+
+def report_candidates(model, top=10):
+    """Print score and mean fit time of the best candidates of a search."""
+    results = model.cv_results_
+    order = np.argsort(results['rank_test_score'])[:top]
+    print(f"{len(results['params'])} candidates, best {top}:")
+    for i in order:
+        resources = (f", {results['n_resources'][i]} samples"
+                     if 'n_resources' in results else "")
+        print(f"  {results['mean_test_score'][i]:.4f} "
+              f"(+/- {results['std_test_score'][i]:.4f}) "
+              f"fit {results['mean_fit_time'][i]:.3f}s"
+              f"{resources}  {results['params'][i]}")
+
+
+def train(templates, labels, search="grid", n_jobs=-1, cv=5, n_iter=20,
+          probability=True, top=10, reduce="none", components=128):
+    """
+    Search the SVC hyperparameters and evaluate the best model.
+        Parameters:
+            probability (bool): refit the best candidate with probability
+                estimates once the search is done
+            reduce, components: see make_estimator
+        Returns:
+            the fitted search, whose best_estimator_ is the final model
     """
-    X = []
-    y = []
-
-    for label in os.listdir(folder_path):
-        class_path = os.path.join(folder_path, label)
-        if os.path.isdir(class_path):
-
-            for img_name in os.listdir(class_path):
-                img_path = os.path.join(class_path, img_name)
-                if img_name.endswith(('.png', '.jpg', '.jpeg')):
-                    image = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-                    image_resized = cv2.resize(image, image_size)
-                    _, binary_img = cv2.threshold(
-                        image_resized, 200, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-                    feature_vector = extract_combined_features(binary_img)
-                    X.append(feature_vector)
-                    y.append((label))
-    return np.array(X), np.array(y)
-
-
-def train(templates, labels):
     X_train, X_test, y_train, y_test = train_test_split(
         templates, labels, test_size=0.2, random_state=42)
-    param_grid = {'C': [0.1, 1, 10, 100],
-                  'gamma': [0.0001, 0.001, 0.1, 1],
-                  'kernel': ['rbf', 'poly', 'linear']}
-
-    svc = svm.SVC(probability=True)
 
-    model = GridSearchCV(svc, param_grid)
+    model = make_search(search, n_jobs=n_jobs, cv=cv, n_iter=n_iter,
+                        reduce=reduce, components=components)
+    start = time.perf_counter()
     model.fit(X_train, y_train)
+    print(f"{search} search done in {time.perf_counter() - start:.1f}s")
+    report_candidates(model, top)
+    print(f"Best parameters: {model.best_params_}")
+
+    if probability:
+        _, prefix = make_estimator(reduce, components)
+        model.best_estimator_.set_params(**{prefix + "probability": True})
+        model.best_estimator_.fit(X_train, y_train)
+
     y_pred = model.predict(X_test)
     print("Classification Report:")
     print(classification_report(y_test, y_pred))
     print(f"Accuracy: {accuracy_score(y_test, y_pred) * 100:.2f}%")
+    print(f"Prediction speed: {measure(model.best_estimator_, X_test, y_test)}")
     return model
 
 
+def compare_reductions(templates, labels, params, sizes, reduce="pca"):
+    """
+    Fit the SVC with the given parameters behind reductions of several
+    sizes and report accuracy and prediction speed of each.
+        Parameters:
+            params (dict): SVC parameters, e.g. best_params_ of a search
+                without reduction
+            sizes (list(int)): numbers of components to try
+        Returns:
+            dict: size ("full" for no reduction) -> measurements
+    """
+    X_train, X_test, y_train, y_test = train_test_split(
+        templates, labels, test_size=0.2, random_state=42)
+    params = {name.rsplit("__", 1)[-1]: value for name, value in params.items()}
+    results = {}
+    for size in [None] + list(sizes):
+        estimator, prefix = make_estimator(reduce if size else "none", size)
+        estimator.set_params(**{prefix + name: value
+                                for name, value in params.items()})
+        start = time.perf_counter()
+        estimator.fit(X_train, y_train)
+        key = size or "full"
+        results[key] = {"fit_s": round(time.perf_counter() - start, 2),
+                        **measure(estimator, X_test, y_test)}
+        print(f"{reduce} {key}: {results[key]}")
+    return results
+
+
 def save_model(model, model_path):
-    joblib.dump(model, compress=True, path=model_path)
-    print(f"Model saved to {model_path}")
+    """Save the best estimator only, memory-mappable (see model_export)."""
+    size = export_model(model, model_path)
+    print(f"Model saved to {model_path} ({size} bytes)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Train the character recognition SVM.")
+    parser.add_argument("--data", default="data/characters",
+                        help="dataset folder, one subfolder per class")
+    parser.add_argument("--output", default="models/character_recognition_svm.pkl",
+                        help="where the trained model is saved")
+    parser.add_argument("--search", choices=SEARCHES, default="grid",
+                        help="hyperparameter search strategy")
+    parser.add_argument("--n-iter", type=int, default=20,
+                        help="candidates sampled by the random search")
+    parser.add_argument("--cv", type=int, default=5, help="cross-validation folds")
+    parser.add_argument("--jobs", type=int, default=-1,
+                        help="parallel fits, -1 for every core")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes extracting new features")
+    parser.add_argument("--no-probability", dest="probability",
+                        action="store_false",
+                        help="do not calibrate probabilities on the final model")
+    parser.add_argument("--top", type=int, default=10,
+                        help="candidates shown in the report")
+    parser.add_argument("--reduce", choices=REDUCTIONS, default="none",
+                        help="dimensionality reduction before the SVC")
+    parser.add_argument("--components", type=int, default=128,
+                        help="features kept by the reduction")
+    parser.add_argument("--compare-reductions", default=None,
+                        metavar="SIZES",
+                        help="comma separated sizes to compare with the "
+                             "unreduced model, e.g. 32,64,128,256")
+    return parser.parse_args(argv)
 
 
-def main():
-    templates, labels = load_data_from_folder("data/characters")
-    model = train(templates, labels)
-    save_model(model, "models/character_recognition_svm.pkl")
+def main(argv=None):
+    args = parse_args(argv)
+    templates, labels = load_data_from_folder(args.data, workers=args.workers)
+    model = train(templates, labels, search=args.search, n_jobs=args.jobs,
+                  cv=args.cv, n_iter=args.n_iter,
+                  probability=args.probability, top=args.top,
+                  reduce=args.reduce, components=args.components)
+    if args.compare_reductions:
+        sizes = [int(size) for size in args.compare_reductions.split(",")]
+        compare_reductions(templates, labels, model.best_params_, sizes,
+                           reduce=args.reduce if args.reduce != "none" else "pca")
+    save_model(model, args.output)
 
 
 if __name__ == "__main__":
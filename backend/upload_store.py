@@ -0,0 +1,292 @@
+import os
+import json
+import struct
+import bisect
+import logging
+import secrets
+import threading
+import time
+
+
+# Partial uploads of every session, under the upload root: resuming only
+# needs the upload id, not the session that started the upload
+PARTIAL_FOLDER = ".partial"
+# Upload ids are random tokens issued by the server (UPLOAD_READY); a
+# client can only resume an upload it was given the id of
+UPLOAD_ID_BYTES = 16
+
+# The received ranges are persisted after this many new bytes or seconds,
+# and when the upload is closed. A crash loses at most that much progress:
+# the chunks are only received again.
+RANGES_SAVE_BYTES = int(os.environ.get("CARLENS_RANGES_SAVE_BYTES",
+                                       str(8 * 1024 * 1024)))
+RANGES_SAVE_INTERVAL = float(os.environ.get("CARLENS_RANGES_SAVE_INTERVAL",
+                                            "1.0"))
+
+# Binary websocket frames: 1-byte message kind, 8-byte offset, payload
+BINARY_HEADER = struct.Struct("!BQ")
+KIND_UPLOAD_CHUNK = 0
+# Encoded (JPEG) frame of a live stream, the offset is the frame index
+KIND_FRAME = 1
+
+
+class IntervalSet:
+    """
+    Sorted, non-overlapping half-open byte ranges [start, end).
+    Adjacent and overlapping ranges are merged on insert.
+    """
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def add(self, start, end):
+        if end <= start:
+            return
+        # First range whose end reaches start, last range whose start
+        # is within end: everything in between merges with [start, end)
+        lo = bisect.bisect_left(self.ends, start)
+        hi = bisect.bisect_right(self.starts, end)
+        if lo < hi:
+            start = min(start, self.starts[lo])
+            end = max(end, self.ends[hi - 1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+
+    def contiguous_prefix(self):
+        """Length of the range starting at offset 0, or 0."""
+        if self.starts and self.starts[0] == 0:
+            return self.ends[0]
+        return 0
+
+    def covered(self):
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def missing(self, total):
+        """Gaps of [0, total) not covered by the set."""
+        gaps = []
+        position = 0
+        for start, end in zip(self.starts, self.ends):
+            if start > position:
+                gaps.append((position, min(start, total)))
+            position = max(position, end)
+            if position >= total:
+                break
+        if position < total:
+            gaps.append((position, total))
+        return gaps
+
+    def to_list(self):
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+
+def new_upload_id():
+    return secrets.token_hex(UPLOAD_ID_BYTES)
+
+
+def is_upload_id(value):
+    """Whether `value` has the form of an id issued by new_upload_id."""
+    return (isinstance(value, str) and len(value) == 2 * UPLOAD_ID_BYTES
+            and all(ch in "0123456789abcdef" for ch in value))
+
+
+class Upload:
+    """
+    A file being received in chunks. Chunks are written with pwrite at
+    their offset into a preallocated `.part` file, so nothing but the
+    received ranges is kept in memory. The ranges are persisted next to
+    the file so an interrupted upload can resume, even after a restart.
+    """
+
+    def __init__(self, upload_folder, filename, size, partial_folder=None,
+                 upload_id=None):
+        """
+            Parameters:
+                upload_folder (str): where the completed file is moved
+                partial_folder (str): where the `.part` file and its
+                    ranges are kept until then (default: upload_folder)
+                upload_id (str): id of the upload to resume, a new one
+                    when not given
+        """
+        self.filename = os.path.basename(filename)
+        self.size = size
+        self.upload_id = upload_id or new_upload_id()
+        self.path = os.path.join(upload_folder, self.filename)
+        partial_folder = partial_folder or upload_folder
+        os.makedirs(partial_folder, exist_ok=True)
+        self.part_path = os.path.join(
+            partial_folder, f"{self.filename}.{self.upload_id}.part")
+        self.ranges_path = f"{self.part_path}.json"
+        self.ranges = IntervalSet(self._load_ranges())
+        self.fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.completed = False
+        self._unsaved_bytes = 0
+        self._saved_at = time.monotonic()
+        # Notifies progressive readers waiting for more data
+        self._progress = threading.Condition()
+        self._preallocate()
+
+    def _load_ranges(self):
+        try:
+            with open(self.ranges_path) as ranges_file:
+                return [tuple(r) for r in json.load(ranges_file)]
+        except (OSError, ValueError):
+            return []
+
+    def _save_ranges(self):
+        tmp_path = f"{self.ranges_path}.tmp"
+        with open(tmp_path, "w") as ranges_file:
+            json.dump(self.ranges.to_list(), ranges_file)
+        os.replace(tmp_path, self.ranges_path)
+        self._unsaved_bytes = 0
+        self._saved_at = time.monotonic()
+
+    def _preallocate(self):
+        if os.fstat(self.fd).st_size >= self.size:
+            return
+        try:
+            os.posix_fallocate(self.fd, 0, self.size)
+        except (AttributeError, OSError):
+            os.ftruncate(self.fd, self.size)
+
+    def write(self, offset, data):
+        """
+        Write a chunk at its offset.
+            Parameters:
+                offset (int): position of the chunk in the file
+                data (bytes-like): chunk payload, written without copying
+            Returns:
+                int: number of bytes written
+        """
+        if offset < 0 or offset + len(data) > self.size:
+            raise ValueError(
+                f"Chunk [{offset}, {offset + len(data)}) outside of "
+                f"{self.filename} ({self.size} bytes)")
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.pwrite(self.fd, view[written:], offset + written)
+        with self._progress:
+            self.ranges.add(offset, offset + written)
+            self._progress.notify_all()
+        self._unsaved_bytes += written
+        if (self._unsaved_bytes >= RANGES_SAVE_BYTES
+                or time.monotonic() - self._saved_at >= RANGES_SAVE_INTERVAL):
+            self._save_ranges()
+        return written
+
+    def is_complete(self):
+        return self.ranges.contiguous_prefix() >= self.size
+
+    def contiguous_prefix(self):
+        with self._progress:
+            return self.ranges.contiguous_prefix()
+
+    def current_path(self):
+        """Path of the data on disk, before or after `finish`."""
+        return self.path if self.completed else self.part_path
+
+    def wait_for_prefix(self, min_bytes, timeout=None):
+        """
+        Block until `min_bytes` contiguous bytes from the start of the
+        file are on disk, or the upload is finished or closed.
+            Returns:
+                int: contiguous bytes available
+        """
+        with self._progress:
+            self._progress.wait_for(
+                lambda: (self.completed or self.fd is None
+                         or self.ranges.contiguous_prefix() >= min_bytes),
+                timeout=timeout)
+            return self.ranges.contiguous_prefix()
+
+    def missing(self):
+        return self.ranges.missing(self.size)
+
+    def status(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "received": self.ranges.to_list(),
+        }
+
+    def close(self):
+        if not self.completed and self._unsaved_bytes:
+            self._save_ranges()
+        with self._progress:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self._progress.notify_all()
+
+    def finish(self):
+        """
+        Move the completed file to its final name.
+            Returns:
+                str: path of the uploaded file
+        """
+        os.replace(self.part_path, self.path)
+        with self._progress:
+            self.completed = True
+        self.close()
+        try:
+            os.remove(self.ranges_path)
+        except OSError:
+            pass
+        logging.info("Upload of %s completed (%d bytes)",
+                     self.filename, self.size)
+        return self.path
+
+
+def open_upload(uploads, upload_folder, filename, size, partial_folder=None,
+                upload_id=None):
+    """
+    Start an upload, or resume the one `upload_id` names. Files with the
+    same name and size sent by two clients get two ids, so they never
+    share a partial file.
+        Parameters:
+            uploads (dict): uploads in progress by upload id, kept per
+                session so that a reconnecting client can resume
+            upload_folder (str): folder of the session's files
+            partial_folder (str): folder of the partial files, see Upload
+            upload_id (str): id the client got in an earlier UPLOAD_READY;
+                ignored unless it names a partial upload of the same file
+    """
+    filename = os.path.basename(filename)
+    upload = uploads.get(upload_id) if is_upload_id(upload_id) else None
+    if upload is not None and (upload.filename, upload.size) != (filename, size):
+        upload = None
+    if upload is None or upload.fd is None:
+        part_path = os.path.join(partial_folder or upload_folder,
+                                 f"{filename}.{upload_id}.part")
+        # Resumed from disk, after a restart or from another session; the
+        # part file is preallocated to the size of its file
+        if upload is None and not (is_upload_id(upload_id)
+                                   and os.path.isfile(part_path)
+                                   and os.path.getsize(part_path) == size):
+            upload_id = None
+        upload = Upload(upload_folder, filename, size, partial_folder,
+                        upload_id)
+        uploads[upload.upload_id] = upload
+    return upload
+
+
+def finish_upload(uploads, upload):
+    uploads.pop(upload.upload_id, None)
+    return upload.finish()
+
+
+def parse_binary_message(message):
+    """
+    Split a binary websocket frame into its header and payload.
+        Returns:
+            tuple: (kind, offset, payload memoryview)
+    """
+    view = memoryview(message)
+    if len(view) < BINARY_HEADER.size:
+        raise ValueError("Binary message shorter than its header")
+    kind, offset = BINARY_HEADER.unpack_from(view)
+    return kind, offset, view[BINARY_HEADER.size:]
@@ -1,67 +1,363 @@
 from collections import Counter
 import cv2
 import os
+import logging
 import numpy as np
 import imutils
 from tkinter import Tk, filedialog, Button, Label, StringVar
 from threading import Thread
-from ocr import OCR
+from ocr import extract_plate_characters
+from predict_characters import classify_character_groups
+from ocr_cache import get_ocr_cache
+from metrics import span
+from plate_tracker import overlaps_any
+from edge_density import (
+    vertical_edge_integral, box_edge_density, find_dense_windows,
+    MIN_EDGE_DENSITY)
+from haar_detector import find_haar_plates
 import skimage.io as io
 KERNEL = np.ones((1, 20), np.uint8)
 MIN_AREA = 500
+# Rows at the top of every frame (camera overlay) that are never analyzed
+FRAME_TOP_CROP = 50
+# Scales candidates are searched at before being refined at full scale,
+# e.g. "0.5" or a pyramid "0.5,0.25"; "1.0" searches the full frame only
+DETECTION_SCALES = tuple(float(scale) for scale in os.environ.get(
+    "CARLENS_DETECTION_SCALES", "1.0").split(","))
+# Padding of the refined areas around coarse boxes, relative to box size
+DETECTION_REFINE_PADDING = 0.25
+# Candidate detector used by default, a key of DETECTORS
+DETECTOR = os.environ.get("CARLENS_DETECTOR", "contour")
 output_dir = "processed_images"
+logger = logging.getLogger(__name__)
 
 
-def process_frame(frame, frame_count):
-    try:
-        frame = frame[50:, :]
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        smoothed_image = cv2.bilateralFilter(gray, 15, 50, 50)
-        edged_image = cv2.Canny(smoothed_image, 130, 210)
-        dilated_image = cv2.dilate(edged_image, KERNEL, iterations=1)
-
-        keypoints = cv2.findContours(
-            dilated_image.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = imutils.grab_contours(keypoints)
-        predictions_strs = []
+def find_plate_candidates(frame, regions=None, scale=1.0, polygon=True):
+    """
+    Find rectangular, edge-dense regions that may contain a plate.
+        Parameters:
+            frame (numpy.ndarray): BGR frame (already cropped)
+            regions (list(tuple)): optional (x, y, w, h) areas to search
+                instead of the whole frame, e.g. from the motion gate
+            scale (float): scale of `frame` relative to the full frame;
+                the size thresholds and kernels are scaled with it
+            polygon (bool): require the contour to approximate to four
+                corners; downscaled searches skip it, as plates lose
+                their corners when shrunk
+        Returns:
+            list(tuple): (x, y, w, h) of every candidate, in frame coordinates
+    """
+    if regions is not None:
         locations = []
-        for contour in contours:
-            if cv2.contourArea(contour) < MIN_AREA:
+        for (rx, ry, rw, rh) in regions:
+            for (x, y, w, h) in find_plate_candidates(
+                    frame[ry:ry + rh, rx:rx + rw], scale=scale,
+                    polygon=polygon):
+                location = (x + rx, y + ry, w, h)
+                if location not in locations:
+                    locations.append(location)
+        return locations
+
+    if scale == 1.0:
+        kernel, diameter = KERNEL, 15
+    else:
+        kernel = np.ones((1, max(1, round(20 * scale))), np.uint8)
+        diameter = max(3, round(15 * scale))
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    smoothed_image = cv2.bilateralFilter(gray, diameter, 50, 50)
+    edged_image = cv2.Canny(smoothed_image, 130, 210)
+    dilated_image = cv2.dilate(edged_image, kernel, iterations=1)
+
+    keypoints = cv2.findContours(
+        dilated_image.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = imutils.grab_contours(keypoints)
+    if not contours:
+        return []
+
+    # The polygon's box lies inside the contour's box and the contour's
+    # area inside its box, so contours whose box is already too small
+    # are dropped before any per-contour polygon work
+    bounds = np.array([cv2.boundingRect(contour) for contour in contours])
+    widths, heights = bounds[:, 2], bounds[:, 3]
+    keep = ((widths * heights >= MIN_AREA * scale * scale)
+            & (widths > 80 * scale) & (heights > 20 * scale))
+
+    boxes = []
+    for index in np.flatnonzero(keep):
+        contour = contours[index]
+        if cv2.contourArea(contour) < MIN_AREA * scale * scale:
+            continue
+        if polygon:
+            approx = cv2.approxPolyDP(contour, 10 * scale, True)
+            if len(approx) != 4:
                 continue
-            approx = cv2.approxPolyDP(contour, 10, True)
-            if len(approx) == 4:
-                x, y, w, h = cv2.boundingRect(approx)
-                if w >= 1.3 * h and w > 80 and h > 20:
-                    roi = edged_image[y:y + h, x:x + w]
-                    vertical_edges = cv2.Sobel(roi, cv2.CV_64F, 1, 0, ksize=3)
-                    edge_density = np.sum(
-                        np.abs(vertical_edges) > 100) / (w * h)
-                    if edge_density > 0.2:
-                        locations.append((x, y, w, h))
-
-        for i, (x, y, w, h) in enumerate(locations):
-
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 0), 2)
-            cropped_image = frame[y:y + h, x:x + w]
-            try:
-                predictions = OCR(cropped_image)
-                predictions_str = "".join(predictions)
-                if len(predictions_str) == 6:
-                    predictions_strs.append(predictions_str)
-                    cv2.imwrite(f"output{predictions_str}.png", cropped_image)
-                    print("found predictions", predictions_str)
-            except:
-                print("Error in frame prediction")
+            x, y, w, h = cv2.boundingRect(approx)
+        else:
+            x, y, w, h = bounds[index]
+        if w >= 1.3 * h and w > 80 * scale and h > 20 * scale:
+            boxes.append((int(x), int(y), int(w), int(h)))
+    if not boxes:
+        return []
+
+    integral = vertical_edge_integral(edged_image)
+    density = box_edge_density(integral, boxes)
+    return [box for box, value in zip(boxes, density)
+            if value > MIN_EDGE_DENSITY]
+
+
+def crop_candidates(frame, locations):
+    """Outline every candidate on the frame and return their crops."""
+    crops = []
+    for (x, y, w, h) in locations:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 0), 2)
+        crops.append(frame[y:y + h, x:x + w])
+    return crops
+
+
+def segment_crop(cropped_image):
+    try:
+        return extract_plate_characters(cropped_image)
+    except Exception:
+        logger.debug("Error in frame prediction", exc_info=True)
+        return []
+
+
+def scale_box(box, factor, width=None, height=None):
+    """Scale an (x, y, w, h) box, clipped to width x height if given."""
+    x, y, w, h = box
+    x0, y0 = int(x * factor), int(y * factor)
+    x1, y1 = int(np.ceil((x + w) * factor)), int(np.ceil((y + h) * factor))
+    if width is not None:
+        x0, x1 = max(0, x0), min(width, x1)
+    if height is not None:
+        y0, y1 = max(0, y0), min(height, y1)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def pad_box(box, padding, width, height):
+    x, y, w, h = box
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def detect_plate_candidates(frame, regions=None, scales=DETECTION_SCALES):
+    """
+    Find plate candidates on downscaled copies of the frame, then refine
+    them at full scale. The expensive bilateral filter and Canny run on
+    `scale**2` of the pixels and only keep boxes passing the size, aspect
+    and edge density checks; the padded areas around them are searched
+    again at full resolution, where the four corner test is applied.
+        Parameters:
+            frame (numpy.ndarray): BGR frame (already cropped)
+            regions (list(tuple)): optional areas to search, full scale
+            scales (tuple(float)): one scale or a pyramid; (1.0,) is the
+                plain full resolution search
+        Returns:
+            list(tuple): (x, y, w, h) of every candidate, full scale
+    """
+    if tuple(scales) == (1.0,):
+        return find_plate_candidates(frame, regions)
+
+    height, width = frame.shape[:2]
+    coarse = []
+    for scale in scales:
+        small = cv2.resize(frame, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+        small_regions = None
+        if regions is not None:
+            small_regions = [scale_box(region, scale, small.shape[1],
+                                       small.shape[0]) for region in regions]
+        for box in find_plate_candidates(small, small_regions, scale=scale,
+                                         polygon=False):
+            box = scale_box(box, 1.0 / scale, width, height)
+            # The same plate is usually found at several pyramid levels
+            if not overlaps_any(box, coarse, 0.5):
+                coarse.append(box)
+
+    locations = []
+    for box in coarse:
+        refine_area = pad_box(box, DETECTION_REFINE_PADDING, width, height)
+        for location in find_plate_candidates(frame, [refine_area]):
+            if location not in locations:
+                locations.append(location)
+    return locations
+
+
+# Every detector takes (cropped frame, regions) and returns (x, y, w, h)
+# boxes: "contour" is the polygon search (downscaled when
+# CARLENS_DETECTION_SCALES is set), "edge_density" scores sliding windows,
+# "haar" runs the bundled plate cascade
+DETECTORS = {
+    "contour": detect_plate_candidates,
+    "edge_density": find_dense_windows,
+    "haar": find_haar_plates,
+}
+
+
+def get_detector(name=DETECTOR):
+    try:
+        return DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown detector {name!r}, expected one of "
+                         f"{tuple(DETECTORS)}") from None
+
+
+def segment_candidates(frame, locations):
+    """
+    Segment the characters of every candidate plate in a frame.
+        Returns:
+            list(list(numpy.ndarray)): characters per location
+    """
+    return [segment_crop(crop) for crop in crop_candidates(frame, locations)]
+
+
+def classify_or_unread(character_groups, context):
+    """
+    classify_character_groups, but a failure (e.g. a model that cannot be
+    loaded) is logged and leaves every plate unread, so the frames are
+    still sent with their boxes.
+        Parameters:
+            context (str): what is classified, for the log
+        Returns:
+            tuple: (predictions per group, whether classification succeeded)
+    """
+    try:
+        return classify_character_groups(character_groups), True
+    except Exception as e:
+        logger.error("Error classifying %s: %s", context, e)
+        return [[] for _ in character_groups], False
+
+
+def read_candidates(frame, locations):
+    """
+    Read every candidate plate of a frame. Crops already read recently
+    come from the OCR cache; the others are segmented and classified with
+    a single predict call.
+        Returns:
+            list(list(str)): predicted characters per location
+    """
+    crops = crop_candidates(frame, locations)
+    cache = get_ocr_cache()
+    keys = [cache.key(crop) for crop in crops]
+    predictions = [cache.get(key) for key in keys]
+    misses = [i for i, prediction in enumerate(predictions)
+              if prediction is None]
+    character_groups = [segment_crop(crops[i]) for i in misses]
+    classified, ok = classify_or_unread(character_groups, "plate candidates")
+    for i, prediction in zip(misses, classified):
+        predictions[i] = prediction
+        # A failure is not remembered: the next frame tries again
+        if ok:
+            cache.put(keys[i], prediction)
+    return predictions
+
+
+def annotate_predictions(frame, locations, predictions):
+    """
+    Draw the candidates on the frame.
+        Returns:
+            list: the 6-character reading of each location, or None
+    """
+    readings = []
+    for (x, y, w, h), prediction in zip(locations, predictions):
+        predictions_str = "".join(prediction)
+        if len(predictions_str) == 6:
+            readings.append(predictions_str)
+            # Crops of the readings are only dumped when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                cv2.imwrite(f"output{predictions_str}.png",
+                            frame[y:y + h, x:x + w])
+            logger.debug("found predictions %s", predictions_str)
+        else:
+            readings.append(None)
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    return readings
+
+
+def analyze_frame(frame, frame_count, regions=None, skip_boxes=(),
+                  detector=DETECTOR):
+    """
+    Detect the plates of a frame and read them.
+        Parameters:
+            frame (numpy.ndarray): BGR frame as decoded
+            frame_count (int): index of the frame in the video
+            regions (list(tuple)): optional areas to search, see
+                find_plate_candidates
+            skip_boxes (list(tuple)): boxes of plates already read with
+                confidence; candidates overlapping them are not OCRed
+            detector (str): candidate detector, a key of DETECTORS
+        Returns:
+            tuple: (processed_frame, detections) where detections is a list
+            of ((x, y, w, h), text) and text is None when not read
+    """
+    frame = frame[FRAME_TOP_CROP:, :]
+    with span("detection"):
+        locations = get_detector(detector)(frame, regions)
+    to_read = [location for location in locations
+               if not overlaps_any(location, skip_boxes)]
+    predictions = read_candidates(frame, to_read)
+    readings = dict(zip(to_read, annotate_predictions(
+        frame, to_read, predictions)))
+    for (x, y, w, h) in locations:
+        if (x, y, w, h) not in readings:
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            # output_path = os.path.join(
-            #     output_dir, f"frame_{frame_count}_{w}_{h}_contour_{i}.png")
-            # cv2.imwrite(output_path, cropped_image)
-        return frame, predictions_strs
+    return frame, [(location, readings.get(location)) for location in locations]
+
+
+def process_frame(frame, frame_count, regions=None, detector=DETECTOR):
+    try:
+        frame, detections = analyze_frame(frame, frame_count, regions,
+                                          detector=detector)
+        return frame, [text for _, text in detections if text]
     except Exception as e:
-        print(f"Error processing frame {frame_count}: {e}")
+        logger.error("Error processing frame %d: %s", frame_count, e)
         return None, None
 
 
+def process_frames(frames, frame_counts, detector=DETECTOR):
+    """
+    Process a window of frames, classifying the characters of every
+    candidate plate of every frame in a single batch.
+        Parameters:
+            frames (list(numpy.ndarray)): BGR frames
+            frame_counts (list(int)): index of each frame in the video
+            detector (str): candidate detector, a key of DETECTORS
+        Returns:
+            list(tuple): (processed_frame, predictions) per frame, like
+            process_frame
+    """
+    detect = get_detector(detector)
+    prepared = []
+    for frame, frame_count in zip(frames, frame_counts):
+        try:
+            frame = frame[FRAME_TOP_CROP:, :]
+            locations = detect(frame, None)
+            prepared.append(
+                (frame, locations, segment_candidates(frame, locations)))
+        except Exception as e:
+            logger.error("Error processing frame %d: %s", frame_count, e)
+            prepared.append(None)
+
+    character_groups = [group for item in prepared if item is not None
+                        for group in item[2]]
+    batch_predictions, _ = classify_or_unread(
+        character_groups, f"a window of {len(frame_counts)} frames")
+    predictions = iter(batch_predictions)
+
+    results = []
+    for item in prepared:
+        if item is None:
+            results.append((None, None))
+            continue
+        frame, locations, groups = item
+        frame_predictions = [next(predictions) for _ in groups]
+        readings = annotate_predictions(frame, locations, frame_predictions)
+        results.append((frame, [text for text in readings if text]))
+    return results
+
+
 def process_video_stream(video_path, label_status):
     try:
         cap = cv2.VideoCapture(video_path)
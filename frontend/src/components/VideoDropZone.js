@@ -19,9 +19,16 @@ const VideoDropZone = ({ plates, onDetectedPlates }) => {
   const [connected, setConnected] = useState(false);
   const isPlaying = useRef(true);
   const [playEnabled, setPlayEnabled] = useState(true);
+  const pendingUpload = useRef(null);
+  const sessionId = useRef(null);
+
+  // Upload ids issued by the server, by file, to resume an upload later
+  const uploadKey = (file) => `upload:${file.name}:${file.size}:${file.lastModified}`;
 
   const connectWebSocket = () => {
-    const ws = new WebSocket("ws://127.0.0.1:8000/ws");
+    // Reconnecting with the session id resumes its uploads
+    const query = sessionId.current ? `?session_id=${sessionId.current}` : "";
+    const ws = new WebSocket(`ws://127.0.0.1:8000/ws${query}`);
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -45,8 +52,29 @@ const VideoDropZone = ({ plates, onDetectedPlates }) => {
 
         if (data.type === "plate_detection") {
           onDetectedPlates(data);
+        } else if (data.type === "SESSION") {
+          sessionId.current = data.session_id;
+        } else if (data.type === "JOB_QUEUED") {
+          console.log(`Server busy, ${data.name} queued at position ${data.position}`);
+        } else if (data.type === "JOB_REJECTED") {
+          console.error(`Server busy, ${data.name} rejected:`, data.reason);
+          setUploading(false);
+        } else if (data.type === "UPLOAD_READY") {
+          if (pendingUpload.current) {
+            const file = pendingUpload.current;
+            localStorage.setItem(uploadKey(file), data.upload_id);
+            sendChunks(file, missingRanges(file.size, data.received));
+          }
+        } else if (data.type === "UPLOAD_INCOMPLETE") {
+          console.warn("Upload incomplete, missing ranges:", data.missing);
+          if (pendingUpload.current) {
+            sendChunks(pendingUpload.current, data.missing);
+          }
         } else if (data.type === "UPLOAD_COMPLETED") {
           console.log("Upload complete to filename:", data.filename);
+          if (pendingUpload.current) {
+            localStorage.removeItem(uploadKey(pendingUpload.current));
+          }
         } else if (data.type === "VIDEO_METADATA") {
           setVideoData(data);
         } else if (data.type === "VIDEO_FRAME") {
@@ -145,29 +173,66 @@ const VideoDropZone = ({ plates, onDetectedPlates }) => {
 
   const handleVideoUpload = (file) => {
     setUploading(true);
+    pendingUpload.current = file;
+    wsRef.current.send(
+      JSON.stringify({
+        type: "UPLOAD_START",
+        filename: file.name,
+        size: file.size,
+        upload_id: localStorage.getItem(uploadKey(file)),
+        progressive: true,
+      })
+    );
+  };
+
+  // Binary chunk layout: 1-byte kind (0 = upload chunk), 8-byte offset, payload
+  // Byte ranges of [0, size) not covered by the sorted received ranges
+  const missingRanges = (size, received) => {
+    const missing = [];
+    let position = 0;
+    for (const [start, end] of received) {
+      if (start > position) {
+        missing.push([position, Math.min(start, size)]);
+      }
+      position = Math.max(position, end);
+    }
+    if (position < size) {
+      missing.push([position, size]);
+    }
+    return missing;
+  };
 
+  // Send the [start, end) byte ranges of the file, then UPLOAD_COMPLETED
+  const sendChunks = (file, ranges) => {
     const chunkSize = 1024 * 1024; // 1MB chunks
-    let offset = 0;
+    const headerSize = 9;
+    let rangeIndex = 0;
+    let offset = ranges.length ? ranges[0][0] : file.size;
 
     const sendChunk = () => {
-      if (offset < file.size) {
-        const chunk = file.slice(offset, offset + chunkSize);
+      while (rangeIndex < ranges.length && offset >= ranges[rangeIndex][1]) {
+        rangeIndex += 1;
+        if (rangeIndex < ranges.length) {
+          offset = ranges[rangeIndex][0];
+        }
+      }
+      if (rangeIndex < ranges.length) {
+        const end = Math.min(offset + chunkSize, ranges[rangeIndex][1]);
+        const chunk = file.slice(offset, end);
         const reader = new FileReader();
 
         reader.onload = function (e) {
           const chunkData = e.target.result;
           if (wsRef.current.readyState === WebSocket.OPEN) {
-            wsRef.current.send(
-              JSON.stringify({
-                type: "UPLOAD_CHUNK",
-                chunk: Array.from(new Uint8Array(chunkData)),
-                filename: file.name,
-                offset,
-              })
-            );
+            const message = new Uint8Array(headerSize + chunkData.byteLength);
+            const header = new DataView(message.buffer);
+            header.setUint8(0, 0);
+            header.setBigUint64(1, BigInt(offset));
+            message.set(new Uint8Array(chunkData), headerSize);
+            wsRef.current.send(message.buffer);
           }
 
-          offset += chunkSize;
+          offset = end;
           sendChunk();
         };
 